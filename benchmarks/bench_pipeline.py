@@ -0,0 +1,132 @@
+"""
+Нагрузочный генератор для RAG пайплайна: прогоняет вопросы через generate_answer из rag_pipeline/rag_simple.ipynb
+с LLM и эмбеддером-заглушками с заданной задержкой и меряет пропускную способность и хвосты латентности
+при разном числе параллельных пользователей.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_pipeline.py --requests 200 --concurrency 1 4 16 --llm-latency 0.3 --output pipeline.json
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import numpy as np
+from langchain.chains import RetrievalQA
+from langchain.prompts import ChatPromptTemplate
+from langchain.retrievers import ContextualCompressionRetriever
+from langchain.retrievers.document_compressors import LLMChainExtractor
+
+from common import ROOT, RandomEmbeddings, StubLLM, latency_stats, load_notebook_definitions, write_results
+
+sys.path.append(os.path.join(ROOT, "rag_pipeline"))
+from bench_retrieval import build_collection  # noqa: E402
+from synthetic_logs import SyntheticLogGenerator  # noqa: E402
+from tracing import STAGES, PipelineTrace  # noqa: E402
+
+NOTEBOOK = os.path.join(ROOT, "rag_pipeline", "rag_simple.ipynb")
+
+
+def load_pipeline() -> Dict[str, Any]:
+    """generate_answer и create_qa_pipeline из ноутбука с нужными им импортами"""
+    namespace = {
+        "ChatPromptTemplate": ChatPromptTemplate,
+        "RetrievalQA": RetrievalQA,
+        "ContextualCompressionRetriever": ContextualCompressionRetriever,
+        "LLMChainExtractor": LLMChainExtractor,
+    }
+    load_notebook_definitions(NOTEBOOK, ["load_yaml", "create_qa_pipeline", "generate_answer"], namespace)
+    # create_qa_pipeline читает load_yaml("config/system_prompt.yaml") относительно корня репозитория:
+    # подставляем абсолютный путь вместо os.chdir, чтобы не менять рабочую папку вызывающего кода
+    load_yaml = namespace["load_yaml"]
+    namespace["load_yaml"] = lambda path: load_yaml(os.path.join(ROOT, path))
+    return namespace
+
+
+def run(
+    n_requests: int,
+    concurrency_levels: List[int],
+    collection_size: int = 10000,
+    llm_latency: float = 0.3,
+    llm_jitter: float = 0.1,
+    embed_latency: float = 0.02,
+    seed: int = 0,
+) -> List[Dict[str, Any]]:
+    generate_answer = load_pipeline()["generate_answer"]
+    vectordb = build_collection(collection_size, RandomEmbeddings(seed=seed, latency=embed_latency), seed)
+    llm = StubLLM(latency=llm_latency, jitter=llm_jitter)
+
+    generator = SyntheticLogGenerator(seed=seed)
+    rng = random.Random(seed)
+    workload = [
+        (rng.choice(generator.questions), record["user_filters"], record["question_filters"])
+        for record in generator.records("logs", n_requests)
+    ]
+
+    def one_request(item):
+        question, user_filters, question_filters = item
+        trace = PipelineTrace()
+        start = time.perf_counter()
+        generate_answer(question, llm, vectordb, user_filters, question_filters, trace=trace)
+        return time.perf_counter() - start, trace
+
+    results = []
+    for concurrency in concurrency_levels:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            done = list(pool.map(one_request, workload))
+        elapsed = time.perf_counter() - start
+        results.append({
+            "name": "pipeline_load",
+            "concurrency": concurrency,
+            "requests": n_requests,
+            "collection_size": collection_size,
+            "llm_latency_sec": llm_latency,
+            "embed_latency_sec": embed_latency,
+            "seconds": elapsed,
+            "throughput_rps": n_requests / elapsed,
+            "latency": latency_stats([latency for latency, _ in done]),
+            # только выполненные этапы, как в PipelineTrace.to_log
+            "stage_latency": {
+                stage: latency_stats([trace.latency[stage] for _, trace in done if stage in trace.latency])
+                for stage in STAGES if any(stage in trace.latency for _, trace in done)
+            },
+            "stage_tokens": {
+                stage: float(np.mean([trace.tokens.get(stage, 0) for _, trace in done]))
+                for stage in STAGES if any(stage in trace.latency for _, trace in done)
+            },
+        })
+    vectordb.delete_collection()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон RAG пайплайна с заглушками LLM и эмбеддера")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--collection-size", type=int, default=10000)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="задержка одного вызова LLM, сек")
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--embed-latency", type=float, default=0.02, help="задержка эмбеддинга запроса, сек")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="путь для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    results = run(
+        args.requests, args.concurrency, args.collection_size,
+        args.llm_latency, args.llm_jitter, args.embed_latency, args.seed,
+    )
+    for r in results:
+        print(
+            f"concurrency={r['concurrency']:>3}  {r['throughput_rps']:.2f} req/s  "
+            f"p50={r['latency']['p50_ms']:.0f}ms p95={r['latency']['p95_ms']:.0f}ms p99={r['latency']['p99_ms']:.0f}ms"
+        )
+    if args.output:
+        write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+Бенчмарк retrieval: MMR по всей коллекции против MMR с префильтром по тегам:
+по позиционным слотам user_tag_* / topic_tag_*, по ключам принадлежности
+и по закэшированным кандидатам (первый и повторный запрос с той же комбинацией фильтров).
+Коллекция синтетическая (случайные нормированные векторы и теги в формате rag_pipeline/chroma),
+поэтому меряется только поиск, без модели эмбеддингов.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_retrieval.py --sizes 1000 10000 50000 --queries 50
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Dict, List
+
+from langchain_community.vectorstores import Chroma
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "rag_pipeline"))
+from common import CAMPUSES, EDUCATION_LEVELS, QUESTION_CATEGORIES, RandomEmbeddings, latency_stats, write_results  # noqa: E402
+from retrieval import CANDIDATES, FilteredMMRRetriever, with_membership_keys  # noqa: E402
+
+
+def random_metadata(rng: random.Random) -> Dict[str, str]:
+    """Метаданные чанка в том же виде, что и в rag_pipeline/chroma после add_membership_keys"""
+    metadata = {"file_name": f"document_{rng.randint(0, 999)}.docx", "source": "synthetic"}
+    user_tags = rng.sample(CAMPUSES, rng.randint(1, 4)) + rng.sample(EDUCATION_LEVELS, rng.randint(1, 4))
+    for i, tag in enumerate(user_tags, start=1):
+        metadata[f"user_tag_{i}"] = tag
+    for i, tag in enumerate(rng.sample(QUESTION_CATEGORIES, rng.randint(1, 4)), start=1):
+        metadata[f"topic_tag_{i}"] = tag
+    return with_membership_keys(metadata)
+
+
+def build_collection(size: int, embeddings: RandomEmbeddings, seed: int = 0) -> Chroma:
+    rng = random.Random(seed)
+    vectordb = Chroma(collection_name=f"bench_{size}", embedding_function=embeddings)
+    batch = 5000
+    for start in range(0, size, batch):
+        n = min(batch, size - start)
+        vectordb.add_texts(
+            texts=[f"chunk {start + i}" for i in range(n)],
+            metadatas=[random_metadata(rng) for _ in range(n)],
+        )
+    return vectordb
+
+
+def time_queries(retrievers: List[FilteredMMRRetriever], queries: List[str]) -> Dict[str, float]:
+    latencies = []
+    for retriever, q in zip(retrievers, queries):
+        start = time.perf_counter()
+        retriever.invoke(q)
+        latencies.append(time.perf_counter() - start)
+    return latency_stats(latencies)
+
+
+def run(sizes: List[int], n_queries: int, seed: int = 0) -> List[Dict]:
+    rng = random.Random(seed)
+    results = []
+    for size in sizes:
+        embeddings = RandomEmbeddings(seed=seed)
+        vectordb = build_collection(size, embeddings, seed)
+        queries = [f"question {i}" for i in range(n_queries)]
+        filters = [
+            ([rng.choice(CAMPUSES), rng.choice(EDUCATION_LEVELS)], [rng.choice(QUESTION_CATEGORIES)])
+            for _ in range(n_queries)
+        ]
+
+        def retrievers(**kwargs) -> List[FilteredMMRRetriever]:
+            # фильтры меняются от запроса к запросу, как у реальных пользователей
+            return [
+                FilteredMMRRetriever(
+                    vectorstore=vectordb, user_filters=user_filters, question_filters=question_filters, **kwargs
+                )
+                for user_filters, question_filters in filters
+            ]
+
+        unfiltered = [FilteredMMRRetriever(vectorstore=vectordb) for _ in queries]
+        result = {
+            "collection_size": size,
+            "queries": n_queries,
+            "unfiltered": time_queries(unfiltered, queries),
+            "positional": time_queries(retrievers(membership_keys=False, cache_candidates=False), queries),
+            "membership": time_queries(retrievers(cache_candidates=False), queries),
+        }
+        # первый проход заполняет CANDIDATES, второй - те же комбинации фильтров, что и в живом трафике
+        CANDIDATES.clear()
+        result["cached_cold"] = time_queries(retrievers(), queries)
+        result["cached_warm"] = time_queries(retrievers(), queries)
+        results.append(result)
+        vectordb.delete_collection()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Латентность MMR с префильтром и без в зависимости от размера коллекции")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="путь для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    results = run(args.sizes, args.queries, args.seed)
+    series = ["unfiltered", "positional", "membership", "cached_cold", "cached_warm"]
+    for r in results:
+        print(f"size={r['collection_size']:>8}  " + "  ".join(
+            f"{name} p50={r[name]['p50_ms']:.1f}ms p95={r[name]['p95_ms']:.1f}ms" for name in series
+        ))
+    if args.output:
+        write_results(args.output, results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Общие заглушки и утилиты для бенчмарков: эмбеддер и LLM с настраиваемой задержкой,
+загрузка функций из ноутбуков, сбор статистики и запись результатов в JSON.
+"""
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+from langchain_core.language_models.llms import LLM
+from pydantic import BaseModel
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+CAMPUSES = ["Москва", "Нижний Новгород", "Санкт-Петербург", "Пермь"]
+EDUCATION_LEVELS = ["бакалавриат", "магистратура", "специалитет", "аспирантура"]
+QUESTION_CATEGORIES = [
+    "Деньги", "Учебный процесс", "Практическая подготовка", "ГИА", "Траектории обучения",
+    "Английский язык", "Цифровые компетенции", "Перемещения студентов / Изменения статусов студентов",
+    "Онлайн-обучение", "Цифровые системы", "Обратная связь", "Дополнительное образование", "Безопасность",
+    "Наука", "Социальные вопросы", "ВУЦ", "Общежития", "ОВЗ", "Внеучебка", "Выпускникам", "Другое",
+]
+
+
+class RandomEmbeddings:
+    """
+    Случайные нормированные векторы вместо multilingual-e5 (размерность как у e5-large).
+    latency - искусственная задержка на вызов в секундах, чтобы имитировать модель.
+    """
+    def __init__(self, dim: int = 1024, seed: int = 0, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.rng = np.random.default_rng(seed)
+        # Generator не потокобезопасен, а нагрузочный прогон зовет эмбеддер из нескольких потоков
+        self._lock = threading.Lock()
+
+    def _vectors(self, n: int) -> List[List[float]]:
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            vectors = self.rng.standard_normal((n, self.dim)).astype(np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._vectors(len(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._vectors(1)[0]
+
+
+class Usage(BaseModel):
+    """Как gigachat.models.Usage: GigaChat кладет в llm_output["token_usage"] модель, а не dict"""
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
+
+
+class StubLLM(LLM):
+    """
+    LLM-заглушка вместо GigaChat: спит latency секунд (± jitter) и возвращает фиксированный текст.
+    Токены считаются по словам и отдаются в llm_output в виде Usage, как у GigaChat.
+    """
+    latency: float = 0.5
+    jitter: float = 0.0
+    answer: str = "FINAL ANSWER: Ответ заглушки со ссылкой на источник https://www.hse.ru"
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> str:
+        time.sleep(max(self.latency + np.random.uniform(-self.jitter, self.jitter), 0.0))
+        return self.answer
+
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        result = super()._generate(prompts, stop=stop, run_manager=run_manager, **kwargs)
+        prompt_tokens = sum(len(p.split()) for p in prompts)
+        completion_tokens = len(self.answer.split()) * len(prompts)
+        result.llm_output = {"token_usage": Usage(
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            total_tokens=prompt_tokens + completion_tokens,
+        )}
+        return result
+
+
+def load_notebook_definitions(notebook_path: str, names: Iterable[str], namespace: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Выполняет ячейки ноутбука, в которых определены names (def/class), в переданном namespace.
+    Нужные импорты кладутся в namespace заранее, строки с ! и % пропускаются.
+    """
+    with open(notebook_path, "r", encoding="utf-8") as f:
+        cells = json.load(f)["cells"]
+    names = set(names)
+    for cell in cells:
+        source = "".join(cell["source"])
+        if cell["cell_type"] != "code":
+            continue
+        if not any(f"def {n}(" in source or f"class {n}" in source for n in names):
+            continue
+        code = "\n".join(line for line in source.splitlines() if not line.lstrip().startswith(("!", "%")))
+        exec(compile(code, f"{notebook_path}:{cells.index(cell)}", "exec"), namespace)
+    missing = [n for n in names if n not in namespace]
+    assert not missing, f"В {notebook_path} не найдены {missing}"
+    return namespace
+
+
+def latency_stats(latencies: List[float]) -> Dict[str, float]:
+    """mean/p50/p95/p99 в миллисекундах"""
+    ms = np.asarray(latencies, dtype=np.float64) * 1000
+    if ms.size == 0:
+        return {}
+    return {
+        "mean_ms": float(ms.mean()),
+        "p50_ms": float(np.percentile(ms, 50)),
+        "p95_ms": float(np.percentile(ms, 95)),
+        "p99_ms": float(np.percentile(ms, 99)),
+    }
+
+
+@contextmanager
+def timed(result: Dict[str, Any]):
+    """Пишет длительность блока в result["seconds"]"""
+    start = time.perf_counter()
+    yield result
+    result["seconds"] = time.perf_counter() - start
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, results: List[Dict[str, Any]]) -> None:
+    """Результаты с коммитом и окружением, чтобы сравнивать прогоны между коммитами"""
+    payload = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=4)
@@ -0,0 +1,192 @@
+"""
+Набор бенчмарков на синтетических логах: парсинг, метрики качества, обработка данных и агрегации дашборда,
+опционально - нагрузочный прогон RAG пайплайна. Результаты пишутся в JSON вместе с хэшем коммита,
+чтобы сравнивать прогоны между коммитами.
+
+Запуск из корня репозитория:
+    python benchmarks/run_benchmarks.py --rows 10000 100000 1000000 --output bench_results.json
+    python benchmarks/run_benchmarks.py --rows 10000 --model-rows 20 --pipeline --output bench_results.json
+Для 10M строк имеет смысл добавить --context-chars 300, иначе файл val_set займет сотни гигабайт.
+process_data принимает список, поэтому записи дашборда целиком лежат в памяти (порядка нескольких КБ на запись
+при полных контекстах): их число ограничено --dashboard-max-rows, большие --rows для дашборда урезаются до него.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import traceback
+from typing import Any, Callable, Dict, List
+
+import pandas as pd
+
+from common import ROOT, load_notebook_definitions, timed, write_results
+from synthetic_logs import SyntheticLogGenerator, write_json_array
+
+sys.path.append(os.path.join(ROOT, "prepocess_calculate"))
+sys.path.append(ROOT)
+from func_to_call import parse_data_with_time  # noqa: E402
+
+# Методы Plots, которые агрегируют данные (без отрисовки и экспорта PNG)
+PLOTS_METHODS = [
+    ("plot_pie_chart", ("campus", "")),
+    ("plot_response_time_chart_with_campus", ()),
+    ("plot_averaged_response_time_chart", ()),
+    ("plot_follow_up_pie_chart", ()),
+    ("plot_conflict_metric", ()),
+    ("plot_response_time_by_category", ()),
+    ("plot_quality_metrics_combined", ()),
+    ("plot_stage_latency_breakdown", ("question_category", 0.95)),
+    ("plot_stage_latency_breakdown", ("campus", 0.95)),
+]
+
+
+def _guarded(name: str, fn: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    """Бенчмарк, которому не хватает зависимостей или моделей, помечается skipped, а не роняет весь прогон"""
+    try:
+        return fn()
+    except Exception as e:
+        traceback.print_exc()
+        return {"name": name, "skipped": f"{type(e).__name__}: {e}"}
+
+
+def _guarded_list(name: str, fn: Callable[[], List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    result = _guarded(name, lambda: {"results": fn()})
+    return result.get("results", [result])
+
+
+def bench_parse(generator: SyntheticLogGenerator, rows: int, workdir: str) -> Dict[str, Any]:
+    path = os.path.join(workdir, f"val_set_{rows}.json")
+    result = {"name": "parse_data_with_time", "rows": rows}
+    start = time.perf_counter()
+    write_json_array(path, generator.records("val_set", rows))
+    result["generate_seconds"] = time.perf_counter() - start
+    result["file_mb"] = os.path.getsize(path) / 2 ** 20
+    with timed(result):
+        parse_data_with_time(path)
+    result["rows_per_sec"] = rows / result["seconds"]
+    os.remove(path)
+    return result
+
+
+def bench_validator(records: List[Dict[str, Any]], neural: bool) -> Dict[str, Any]:
+    from metrics import ValidatorSimple
+
+    validator = ValidatorSimple(neural=neural)
+    result = {"name": "ValidatorSimple.score_sample", "rows": len(records), "neural": neural}
+    with timed(result):
+        for r in records:
+            validator.score_sample(r["answer"], r["ground_truth"], r["contexts"])
+    result["rows_per_sec"] = len(records) / result["seconds"]
+    return result
+
+
+def bench_hallucination(records: List[Dict[str, Any]]) -> Dict[str, Any]:
+    import numpy as np
+    import spacy
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from sklearn.metrics.pairwise import cosine_similarity
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipeline
+
+    namespace = {
+        "np": np, "torch": torch, "spacy": spacy, "SentenceTransformer": SentenceTransformer,
+        "cosine_similarity": cosine_similarity, "pipeline": pipeline,
+        "AutoModelForSequenceClassification": AutoModelForSequenceClassification, "AutoTokenizer": AutoTokenizer,
+    }
+    load_notebook_definitions(os.path.join(ROOT, "hackaton_metrics2.ipynb"), ["HallucinationMetric"], namespace)
+
+    result = {"name": "HallucinationMetric.faithfulness_score", "rows": len(records)}
+    start = time.perf_counter()
+    metric = namespace["HallucinationMetric"]()
+    result["init_seconds"] = time.perf_counter() - start
+    with timed(result):
+        for r in records:
+            # как в hackaton_metrics2.ipynb: контекст обрезается до 512 символов
+            metric.faithfulness_score(
+                "\n".join(r["contexts"])[:512], r["answer"], r["question_filters"], weights=(0.4, 0.3, 0.05, 0.25)
+            )
+    result["rows_per_sec"] = len(records) / result["seconds"]
+    return result
+
+
+def load_dashboard():
+    """dashboard.py без отрисовки: графики строятся, но не выводятся и не экспортируются в PNG"""
+    import dashboard
+
+    dashboard.show_plot_with_download_below = lambda fig, filename: None
+    return dashboard
+
+
+def bench_dashboard(dashboard, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = len(records)
+    result = {"name": "process_data", "rows": rows}
+    with timed(result):
+        df = dashboard.process_data(records)
+    result["rows_per_sec"] = rows / result["seconds"]
+    results = [result]
+
+    graphs = dashboard.Plots(df)
+    for method, args in PLOTS_METHODS:
+        result = {"name": f"Plots.{method}", "args": list(args), "rows": rows}
+        with timed(result):
+            getattr(graphs, method)(*args)
+        result["rows_per_sec"] = rows / result["seconds"]
+        results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки парсинга, метрик и дашборда на синтетических логах")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000],
+                        help="размеры синтетических логов (10k - 10M)")
+    parser.add_argument("--model-rows", type=int, default=50,
+                        help="сколько записей прогонять через ValidatorSimple и HallucinationMetric")
+    parser.add_argument("--neural", action="store_true", help="считать answer_correctness_neural в ValidatorSimple")
+    parser.add_argument("--skip-models", action="store_true", help="не запускать ValidatorSimple и HallucinationMetric")
+    parser.add_argument("--pipeline", action="store_true", help="добавить нагрузочный прогон RAG пайплайна")
+    parser.add_argument("--context-chars", type=int, default=None, help="обрезать контексты до этой длины")
+    parser.add_argument("--dashboard-max-rows", type=int, default=1000000,
+                        help="максимум записей для бенчмарков дашборда, все они держатся в памяти списком")
+    parser.add_argument("--workdir", default=None, help="папка для временных файлов (по умолчанию tmp)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    generator = SyntheticLogGenerator(seed=args.seed, context_chars=args.context_chars)
+    results = []
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        for rows in args.rows:
+            results.append(bench_parse(generator, rows, workdir))
+
+    loaded = _guarded("load_dashboard", lambda: {"module": load_dashboard()})
+    dashboard = loaded.get("module")
+    for rows in args.rows:
+        if dashboard is None:
+            results.append({"name": "process_data", "rows": rows, "skipped": loaded["skipped"]})
+            continue
+        dashboard_rows = min(rows, args.dashboard_max_rows)
+        if dashboard_rows < rows:
+            print(f"Дашборд: {rows} строк урезано до --dashboard-max-rows={dashboard_rows}")
+        records = list(generator.records("dashboard", dashboard_rows))
+        results.extend(_guarded_list("process_data", lambda: bench_dashboard(dashboard, records)))
+        del records
+
+    if not args.skip_models:
+        records = list(generator.records("dashboard", args.model_rows))
+        results.append(_guarded("ValidatorSimple.score_sample", lambda: bench_validator(records, args.neural)))
+        results.append(_guarded("HallucinationMetric.faithfulness_score", lambda: bench_hallucination(records)))
+
+    if args.pipeline:
+        import bench_pipeline
+        results.extend(_guarded_list("pipeline_load", lambda: bench_pipeline.run(200, [1, 4, 16], seed=args.seed)))
+
+    write_results(args.output, results)
+    summary = pd.DataFrame(results).reindex(columns=["name", "rows", "concurrency", "seconds", "rows_per_sec", "skipped"])
+    print(summary.dropna(axis=1, how="all").to_string(index=False))
+    print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+"""
+Генератор синтетических логов для бенчмарков.
+Вопросы, ответы и контексты берутся из prepocess_calculate/datasets/val_set.json и перемешиваются,
+кампусы, категории, время ответа и история чата сэмплируются случайно.
+
+Схемы:
+  - val_set   - как prepocess_calculate/datasets/val_set.json (вход parse_data_with_time);
+  - logs      - как logs.json (сырые логи бота);
+  - dashboard - формат, который читает dashboard.py (после hackaton_metrics1/2.ipynb).
+
+Запуск из корня репозитория (файл пишется потоково, в памяти не держится):
+    python benchmarks/synthetic_logs.py --schema val_set --rows 100000 --output synthetic_val_set.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from typing import Any, Dict, Iterator, Optional
+
+from common import CAMPUSES, EDUCATION_LEVELS, QUESTION_CATEGORIES, ROOT
+
+sys.path.append(os.path.join(ROOT, "prepocess_calculate"))
+from func_to_call import _parse_contexts  # noqa: E402
+
+VAL_SET = os.path.join(ROOT, "prepocess_calculate", "datasets", "val_set.json")
+SCHEMAS = ["val_set", "logs", "dashboard"]
+ROLES = ["Студент", "Абитуриент", "Сотрудник"]
+WINNERS = ["Saiga", "GigaChat", "Оба хорошо", "Оба плохо"]
+
+
+class SyntheticLogGenerator:
+    """Генерирует записи логов в схемах val_set / logs / dashboard на основе реальных вопросов из val_set.json"""
+    def __init__(
+        self,
+        seed_path: str = VAL_SET,
+        seed: int = 0,
+        follow_up_rate: float = 0.45,
+        context_chars: Optional[int] = None,
+    ):
+        """
+        param seed_path: файл в формате val_set.json, из которого берутся тексты
+        param follow_up_rate: доля записей с уточняющим вопросом / непустой chat_history
+        param context_chars: обрезать контексты до этой длины (запись val_set с полными контекстами ~17 КБ,
+                             для миллионов строк имеет смысл уменьшить)
+        """
+        self.rng = random.Random(seed)
+        self.follow_up_rate = follow_up_rate
+        with open(seed_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.questions = [r["Вопрос пользователя"] for r in data if r.get("Вопрос пользователя")]
+        self.answers = [r[k] for r in data for k in ("Saiga", "Giga", "Ответ AI") if r.get(k)]
+        self.contexts = [
+            c["text"].replace("'", '"')[:context_chars]
+            for r in data for c in _parse_contexts(r.get("Ресурсы для ответа") or "")
+        ]
+
+    def _profile(self) -> Dict[str, Any]:
+        campus = self.rng.choice(CAMPUSES)
+        level = self.rng.choice(EDUCATION_LEVELS)
+        categories = self.rng.sample(QUESTION_CATEGORIES, self.rng.randint(1, 2))
+        return {
+            "role": self.rng.choice(ROLES),
+            "campus": campus,
+            "level": level,
+            "category": categories[0],
+            "user_filters": [campus, level],
+            "question_filters": categories,
+        }
+
+    def _response_time(self) -> float:
+        # логнормальное распределение с медианой ~2.5 сек и длинным хвостом, как у реальных ответов
+        return round(self.rng.lognormvariate(0.9, 0.35), 6)
+
+    def _contexts(self, n: int = 4):
+        return [self.rng.choice(self.contexts) for _ in range(n)]
+
+    def _resources(self, profile: Dict[str, Any]) -> str:
+        """Строка 'Ресурсы для ответа' в том же формате, что и repr списка Document"""
+        docs = []
+        for text in self._contexts():
+            metadata = {"file_name": f"document_{self.rng.randint(0, 999)}.docx", "source": "synthetic"}
+            for i, tag in enumerate(profile["user_filters"], start=1):
+                metadata[f"user_tag_{i}"] = tag
+            for i, tag in enumerate(profile["question_filters"], start=1):
+                metadata[f"topic_tag_{i}"] = tag
+            docs.append(f"Document(page_content='{text}', metadata={metadata!r})")
+        return "[" + ", ".join(docs) + "]"
+
+    def _chat_history(self) -> Dict[str, Any]:
+        if self.rng.random() >= self.follow_up_rate:
+            return {}
+        n = self.rng.randint(1, 3)
+        return {
+            "old_contexts": self._contexts(n),
+            "old_questions": [self.rng.choice(self.questions) for _ in range(n)],
+            "old_answers": [self.rng.choice(self.answers) for _ in range(n)],
+        }
+
+    def val_set_record(self) -> Dict[str, Any]:
+        p = self._profile()
+        record = {
+            "Выбранная роль": p["role"],
+            "Кампус": p["campus"],
+            "Уровень образования": p["level"].capitalize(),
+            "Категория вопроса": p["category"],
+            "Вопрос пользователя": self.rng.choice(self.questions),
+            "Ресурсы для ответа": self._resources(p),
+            "Ответ AI": self.rng.choice(self.answers),
+            "Время ответа модели (сек)": self._response_time(),
+            "user_filters": p["user_filters"],
+            "question_filters": p["question_filters"],
+            "Saiga": self.rng.choice(self.answers),
+            "Giga": self.rng.choice(self.answers),
+            "Кто лучше?": self.rng.choice(WINNERS),
+            "Комментарий": None,
+            "Ответ AI (уточнение)": None,
+            "Время ответа модели на уточненный вопрос (сек)": None,
+            "Ресурсы для ответа (уточнение)": None,
+            "Уточненный вопрос пользователя": None,
+        }
+        if self.rng.random() < self.follow_up_rate:
+            record.update({
+                "Уточненный вопрос пользователя": self.rng.choice(self.questions),
+                "Ответ AI (уточнение)": self.rng.choice(self.answers),
+                "Время ответа модели на уточненный вопрос (сек)": self._response_time(),
+                "Ресурсы для ответа (уточнение)": self._resources(p),
+            })
+        return record
+
+    def logs_record(self) -> Dict[str, Any]:
+        p = self._profile()
+        return {
+            "Выбранная роль": p["role"],
+            "Кампус": p["campus"],
+            "Уровень образования": p["level"].capitalize(),
+            "Категория вопроса": p["category"],
+            "Время ответа модели": self._response_time(),
+            "user_filters": p["user_filters"],
+            "question_filters": p["question_filters"],
+            "chat_history": self._chat_history(),
+        }
+
+    def dashboard_record(self) -> Dict[str, Any]:
+        p = self._profile()
+        response_time = self._response_time()
+        # доли этапов примерно как у GigaChat: сжатие контекстов и генерация занимают основное время
+        shares = [self.rng.uniform(0.01, 0.05), self.rng.uniform(0.02, 0.1),
+                  self.rng.uniform(0.3, 0.6), self.rng.uniform(0.3, 0.5)]
+        total = sum(shares)
+        return {
+            "selected_role": p["role"],
+            "campus": p["campus"],
+            "education_level": p["level"].capitalize(),
+            "question_category": p["category"],
+            "user_filters": p["user_filters"],
+            "question_filters": p["question_filters"],
+            "question": self.rng.choice(self.questions),
+            "answer": self.rng.choice(self.answers),
+            "ground_truth": self.rng.choice(self.answers),
+            "contexts": self._contexts(),
+            "source": self.rng.choice(["saiga", "giga"]),
+            "rating": self.rng.choice(["good", "bad"]),
+            "response_time": response_time,
+            "context_recall": self.rng.random() * 0.3,
+            "context_precision": self.rng.random() * 0.2,
+            "answer_correctness_literal": self.rng.uniform(10, 60),
+            "answer_correctness_neural": self.rng.uniform(0.5, 0.9),
+            "Hallucination_metric": self.rng.random(),
+            "chat_history": self._chat_history(),
+            "stage_latency": {
+                stage: round(response_time * share / total, 6)
+                for stage, share in zip(["embedding", "retrieval", "compression", "generation"], shares)
+            },
+            "stage_tokens": {
+                "embedding": 0, "retrieval": 0,
+                "compression": self.rng.randint(800, 3000), "generation": self.rng.randint(200, 900),
+            },
+        }
+
+    def records(self, schema: str, n: int) -> Iterator[Dict[str, Any]]:
+        make = {
+            "val_set": self.val_set_record,
+            "logs": self.logs_record,
+            "dashboard": self.dashboard_record,
+        }[schema]
+        for _ in range(n):
+            yield make()
+
+
+def write_json_array(path: str, records: Iterator[Dict[str, Any]]) -> int:
+    """Потоковая запись JSON-массива, чтобы не держать 10M записей в памяти"""
+    n = 0
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for record in records:
+            if n:
+                f.write(",\n")
+            f.write(json.dumps(record, ensure_ascii=False))
+            n += 1
+        f.write("\n]\n")
+    return n
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические логи в схемах val_set.json / logs.json / дашборда")
+    parser.add_argument("--schema", choices=SCHEMAS, default="val_set")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--context-chars", type=int, default=None, help="обрезать контексты до этой длины")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    generator = SyntheticLogGenerator(seed=args.seed, context_chars=args.context_chars)
+    n = write_json_array(args.output, generator.records(args.schema, args.rows))
+    print(f"Записано {n} записей ({args.schema}) в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,6 @@
 import json
+import os
+import threading
 
 import pandas as pd
 import plotly.express as px
@@ -6,6 +8,8 @@ import plotly.graph_objects as go
 import streamlit as st
 from streamlit_autorefresh import st_autorefresh
 
+from question_clusters import CLUSTER_MODES, HashingEmbeddings, load_clusterer
+
 # ---------------------------
 # ⁡⁣⁣⁢НАСТРОЙКА СТРАНИЦЫ STREAMLIT⁡
 # ---------------------------
@@ -50,6 +54,58 @@ def load_data(file_name: str):
         return json.load(file)
 
 
+# ---------------------------
+# ⁡⁣⁣⁢КЛАСТЕРЫ ПОВТОРЯЮЩИХСЯ ВОПРОСОВ⁡
+# ---------------------------
+# Режим кластеризации задается переменной окружения QUESTION_CLUSTERS_MODE:
+# semantic (по умолчанию) - близкие по смыслу вопросы (multilingual-e5), lexical - почти дословные повторы.
+# У каждого режима свой порог и свой файл состояния (CLUSTER_MODES), состояние сохраняется на диск,
+# чтобы после перезапуска не пересчитывать историю.
+CLUSTERS_MODE = os.environ.get("QUESTION_CLUSTERS_MODE", "semantic")
+
+
+@st.cache_resource
+def get_question_clusterer(mode: str):
+    """
+    Возвращает кластеризатор вопросов, общий для всех перезагрузок страницы.
+    Если для semantic нет sentence-transformers или модели e5, используется lexical.
+    :param mode: Режим кластеризации из CLUSTER_MODES.
+    :return: QuestionClusterer.
+    """
+    try:
+        return load_clusterer(mode)
+    except (ImportError, OSError):
+        if mode == "lexical":
+            raise
+        return load_clusterer("lexical")
+
+
+@st.cache_resource
+def get_question_clusters_lock(mode: str):
+    """
+    Блокировка для кластеризатора: он общий для всех сессий, и каждая обновляет его при автообновлении страницы.
+    :param mode: Режим кластеризации из CLUSTER_MODES.
+    :return: threading.Lock.
+    """
+    return threading.Lock()
+
+
+def update_question_clusters(data, mode: str = CLUSTERS_MODE, n: int = 10):
+    """
+    Добавляет в кластеры только новые записи логов, сохраняет состояние и возвращает самые частые кластеры.
+    :param data: Сырые данные (список словарей).
+    :param mode: Режим кластеризации из CLUSTER_MODES.
+    :param n: Сколько кластеров вернуть.
+    :return: (QuestionClusterer.top_clusters(n), доля повторяющихся вопросов, фактический режим).
+    """
+    clusterer = get_question_clusterer(mode)
+    mode = "lexical" if isinstance(clusterer.embeddings, HashingEmbeddings) else "semantic"
+    with get_question_clusters_lock(mode):
+        if clusterer.update(data):
+            clusterer.save(CLUSTER_MODES[mode]["state_path"])
+        return clusterer.top_clusters(n=n), clusterer.repeat_rate(), mode
+
+
 # ---------------------------
 # ⁡⁣⁣⁢ФУНКЦИЯ ОБРАБОТКИ ДАННЫХ⁡
 # ---------------------------
@@ -60,6 +116,8 @@ def process_data(data):
       - conflict_metric: показывает наличие конфликтов (например, если в истории чата более одного уточняющего вопроса и время ответа > 3 сек)
       - has_chat_history/has_contexts: флаги наличия истории чата или контекстов.
     Также происходит приведение времени ответа к числовому типу.
+    Если в логах есть stage_latency / stage_tokens (время и токены по этапам RAG пайплайна),
+    они разворачиваются в столбцы latency_<этап> и tokens_<этап>.
     :param data: Сырые данные (список словарей).
     :return: Обработанный DataFrame.
     """
@@ -86,6 +144,15 @@ def process_data(data):
     else:
         df["conflict_metric"] = 0
 
+    # Разворачиваем поэтапное время и токены в отдельные числовые столбцы
+    for column, prefix in (("stage_latency", "latency_"), ("stage_tokens", "tokens_")):
+        if column in df.columns:
+            stages = pd.json_normalize(
+                df[column].apply(lambda x: x if isinstance(x, dict) else {}).tolist()
+            ).add_prefix(prefix)
+            stages.index = df.index
+            df = df.join(stages.apply(pd.to_numeric, errors="coerce"))
+
     # Приводим время ответа к числовому типу для последующих вычислений
     df["response_time"] = pd.to_numeric(df["response_time"], errors="coerce")
     return df
@@ -408,6 +475,82 @@ class Plots:
         )
         show_plot_with_download_below(fig, "combined_quality_metrics")
 
+    # 11. Самые частые повторяющиеся вопросы
+    def plot_repeated_question_clusters(self, clusters: pd.DataFrame):
+        """
+        Строит столбчатую диаграмму с разбивкой по кампусам для самых частых кластеров повторяющихся вопросов
+        и таблицу с примерами вопросов. Учитываются только кампусы из отфильтрованных данных.
+        :param clusters: Результат QuestionClusterer.top_clusters().
+        """
+        if clusters.empty:
+            return st.info("Повторяющихся вопросов пока нет")
+        campuses = set(self.data["campus"].dropna()) if "campus" in self.data.columns else None
+        rows = [
+            {"exemplar": row.exemplar, "campus": campus, "count": count}
+            for row in clusters.itertuples()
+            for campus, count in row.campus_counts.items()
+            if campuses is None or campus in campuses
+        ]
+        if not rows:
+            return st.info("Нет данных для построения графика")
+        fig = px.bar(
+            pd.DataFrame(rows),
+            x="count",
+            y="exemplar",
+            color="campus",
+            orientation="h",
+            labels={"count": "Число вопросов", "exemplar": "Пример вопроса", "campus": "Кампус"},
+            color_discrete_sequence=px.colors.qualitative.Set3
+        )
+        fig.update_layout(yaxis={"categoryorder": "total ascending"})
+        show_plot_with_download_below(fig, "repeated_questions")
+        st.dataframe(
+            clusters[["count", "exemplars"]].rename(
+                columns={"count": "Число вопросов", "exemplars": "Примеры вопросов"}),
+            use_container_width=True
+        )
+
+    # 12. Разбивка времени ответа по этапам RAG пайплайна
+    def plot_stage_latency_breakdown(self, group_col: str, quantile: float = 0.5):
+        """
+        Строит stacked-диаграмму времени этапов (cache, embedding, retrieval, compression, generation)
+        для каждой группы и таблицу p50/p95 по этапам.
+        :param group_col: Столбец группировки (question_category или campus).
+        :param quantile: Квантиль времени этапа на диаграмме (0.5 - p50, 0.95 - p95).
+        """
+        stage_cols = [c for c in self.data.columns if c.startswith("latency_")]
+        if self.data.empty or group_col not in self.data.columns or not stage_cols:
+            return st.info("Нет данных о времени этапов")
+        grouped = self.data.groupby(group_col)[stage_cols]
+        breakdown = grouped.quantile(quantile).reset_index()
+        melted = breakdown.melt(
+            id_vars=group_col,
+            value_vars=stage_cols,
+            var_name="stage",
+            value_name="seconds"
+        )
+        melted["stage"] = melted["stage"].str.removeprefix("latency_")
+        fig = px.bar(
+            melted,
+            x=group_col,
+            y="seconds",
+            color="stage",
+            barmode="stack",
+            labels={
+                group_col: "",
+                "seconds": f"p{int(quantile * 100)} времени этапа (сек)",
+                "stage": "Этап"
+            },
+            color_discrete_sequence=px.colors.qualitative.Safe
+        )
+        show_plot_with_download_below(fig, f"stage_latency_{group_col}_p{int(quantile * 100)}")
+
+        table = pd.concat(
+            {"p50": grouped.quantile(0.5), "p95": grouped.quantile(0.95)}, axis=1
+        )
+        table.columns = [f"{stage.removeprefix('latency_')} {q}" for q, stage in table.columns]
+        st.dataframe(table.round(3), use_container_width=True)
+
 
 # ---------------------------
 # ⁡⁣⁣⁢ФУНКЦИЯ САЙДБАРА ДЛЯ ФИЛЬТРАЦИИ ДАННЫХ⁡
@@ -466,6 +609,7 @@ def main():
     # Загрузка данных из обновленного JSON-файла
     data = load_data("output_last (1).json")
     df = process_data(data)
+    clusters, repeat_rate, clusters_mode = update_question_clusters(data)
     filtered_df = sidebar_layout(df)
     if filtered_df.empty:
         st.info("Нет данных для отображения. Попробуйте изменить фильтры.")
@@ -529,6 +673,29 @@ def main():
     st.subheader("Метрика конфликтного ответа")
     graphs.plot_conflict_metric()
 
+    # --- 7) Время по этапам RAG пайплайна ---
+    st.markdown("## Время ответа по этапам пайплайна")
+    quantile = st.radio("Квантиль", ["p50", "p95"], horizontal=True)
+    quantile = 0.5 if quantile == "p50" else 0.95
+    col6, col7 = st.columns(2)
+    with col6:
+        st.subheader("По категориям вопросов")
+        graphs.plot_stage_latency_breakdown("question_category", quantile)
+    with col7:
+        st.subheader("По кампусам")
+        graphs.plot_stage_latency_breakdown("campus", quantile)
+
+    # --- 8) Повторяющиеся вопросы ---
+    if clusters_mode == "semantic":
+        st.markdown("## Повторяющиеся вопросы (близкие по смыслу)")
+    else:
+        st.markdown("## Повторяющиеся вопросы (почти дословные совпадения)")
+        if CLUSTERS_MODE == "semantic":
+            st.caption("Модель multilingual-e5 недоступна (sentence-transformers или веса модели), "
+                       "кластеры построены по символьным n-граммам")
+    st.metric("Доля повторяющихся вопросов", f"{repeat_rate * 100:.1f}%")
+    graphs.plot_repeated_question_clusters(clusters)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,269 @@
+import os
+import pickle
+import re
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+# Режимы кластеризации: свой эмбеддер, порог близости к центроиду и файл состояния.
+# semantic - близкие по смыслу вопросы (multilingual-e5), lexical - почти дословные повторы (символьные n-граммы).
+# У e5 косинусная близость даже несвязанных вопросов обычно выше 0.7, поэтому порог у него выше, чем у n-грамм.
+CLUSTER_MODES = {
+    "semantic": {"threshold": 0.9, "state_path": "question_clusters_semantic_state.pkl"},
+    "lexical": {"threshold": 0.8, "state_path": "question_clusters_state.pkl"},
+}
+E5_MODEL = "intfloat/multilingual-e5-large"
+
+# Поля, в которых может лежать текст вопроса (логи дашборда, val_set.json, распарсенные данные)
+QUESTION_FIELDS = ["question", "user_question", "Вопрос пользователя"]
+CAMPUS_FIELDS = ["campus", "Кампус"]
+
+
+def _first_field(record: Dict[str, Any], fields: List[str]) -> Optional[str]:
+    for field in fields:
+        value = record.get(field)
+        if value:
+            return str(value)
+    return None
+
+
+class HashingEmbeddings:
+    """
+    Легковесный эмбеддер без нейросети: хэширование символьных n-грамм в вектор фиксированной длины.
+    Находит почти дословные повторы и перефразировки с общими словами.
+    Для смысловой близости - E5Embeddings (или любой объект с embed_documents).
+    """
+    def __init__(self, dim: int = 2048, ngram: int = 3):
+        self.dim = dim
+        self.ngram = ngram
+
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            word = f" {word} "
+            for i in range(max(len(word) - self.ngram + 1, 1)):
+                vector[zlib.crc32(word[i:i + self.ngram].encode("utf-8")) % self.dim] += 1
+        return vector
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(t).tolist() for t in texts]
+
+
+class E5Embeddings:
+    """
+    Смысловой эмбеддер multilingual-e5 для кластеров близких по смыслу вопросов.
+    sentence-transformers импортируется при создании, без него доступен только HashingEmbeddings.
+    """
+    def __init__(self, model_name: str = E5_MODEL, device: str = "cpu", batch_size: int = 32):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device=device)
+        self.batch_size = batch_size
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        # e5 обучен с префиксами, вопросы сравниваются между собой как query
+        return self.model.encode(
+            [f"query: {t}" for t in texts], batch_size=self.batch_size, normalize_embeddings=True
+        ).tolist()
+
+
+class QuestionClusterer:
+    """
+    Инкрементальная кластеризация повторяющихся вопросов.
+    С HashingEmbeddings (по умолчанию) в кластер попадают почти дословные повторы и перефразировки с общими словами,
+    с E5Embeddings - близкие по смыслу вопросы; эмбеддер, порог и файл состояния для обоих задает load_clusterer.
+    Каждый вопрос эмбеддится один раз, кандидаты-кластеры ищутся через LSH (случайные гиперплоскости),
+    поэтому обработка новых логов не требует попарного сравнения со всей историей.
+    Для каждого кластера храним центроид, число вопросов, разбивку по кампусам и примеры вопросов.
+    """
+    def __init__(
+        self,
+        embeddings=None,
+        threshold: float = 0.8,
+        n_tables: int = 8,
+        n_bits: int = 12,
+        n_exemplars: int = 3,
+        seed: int = 0,
+    ):
+        """
+        param embeddings: объект с embed_documents, по умолчанию HashingEmbeddings
+        param threshold: минимальная косинусная близость вопроса к центроиду кластера (0.8 подобран для HashingEmbeddings)
+        param n_tables: число LSH таблиц (больше - выше полнота, дороже вставка)
+        param n_bits: число гиперплоскостей в таблице (больше - меньше кандидатов)
+        param n_exemplars: сколько примеров вопросов хранить на кластер
+        """
+        self.embeddings = embeddings or HashingEmbeddings()
+        # эмбеддер и размерность, с которыми построены кластеры, проверяются в load
+        self.embedder = type(self.embeddings).__name__
+        self.dim: Optional[int] = None
+        self.threshold = threshold
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_exemplars = n_exemplars
+        self.seed = seed
+
+        self.reset()
+
+    def reset(self) -> None:
+        """Сброс всех кластеров"""
+        self.n_processed = 0
+        self._planes: Optional[np.ndarray] = None
+        self._buckets: List[Dict[int, set]] = [{} for _ in range(self.n_tables)]
+        self.centroids: List[np.ndarray] = []
+        self.counts: List[int] = []
+        self.campus_counts: List[Counter] = []
+        self.exemplars: List[List[str]] = []
+
+    def __getstate__(self):
+        # эмбеддер может быть тяжелой моделью, его не сохраняем
+        state = self.__dict__.copy()
+        state["embeddings"] = None
+        return state
+
+    def _signatures(self, vector: np.ndarray) -> List[int]:
+        """LSH ключ вектора в каждой таблице"""
+        if self._planes is None:
+            rng = np.random.default_rng(self.seed)
+            self._planes = rng.standard_normal((self.n_tables, self.n_bits, vector.shape[0])).astype(np.float32)
+        bits = (self._planes @ vector) > 0
+        return (bits @ (1 << np.arange(self.n_bits))).tolist()
+
+    def _assign(self, vector: np.ndarray, question: str, campus: Optional[str]) -> int:
+        signatures = self._signatures(vector)
+        candidates = set()
+        for table, key in zip(self._buckets, signatures):
+            candidates |= table.get(key, set())
+
+        best, best_sim = -1, self.threshold
+        for cluster_id in candidates:
+            sim = float(self.centroids[cluster_id] @ vector)
+            if sim >= best_sim:
+                best, best_sim = cluster_id, sim
+
+        if best < 0:
+            best = len(self.centroids)
+            self.centroids.append(vector.copy())
+            self.counts.append(0)
+            self.campus_counts.append(Counter())
+            self.exemplars.append([])
+        else:
+            # центроид - нормированное среднее векторов кластера
+            centroid = self.centroids[best] * self.counts[best] + vector
+            self.centroids[best] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+        for table, key in zip(self._buckets, signatures):
+            table.setdefault(key, set()).add(best)
+        self.counts[best] += 1
+        if campus:
+            self.campus_counts[best][campus] += 1
+        if len(self.exemplars[best]) < self.n_exemplars and question not in self.exemplars[best]:
+            self.exemplars[best].append(question)
+        return best
+
+    def update(self, records: List[Dict[str, Any]]) -> int:
+        """
+        Добавляет новые записи логов. Логи только дописываются,
+        поэтому обрабатываются записи начиная с n_processed, история не пересчитывается.
+        return: число обработанных новых вопросов.
+        """
+        if len(records) < self.n_processed:
+            # файл логов перезаписали, считаем заново
+            self.reset()
+        new_records = records[self.n_processed:]
+        self.n_processed = len(records)
+        rows = []
+        for record in new_records:
+            question = _first_field(record, QUESTION_FIELDS)
+            if question:
+                rows.append((question, _first_field(record, CAMPUS_FIELDS)))
+        if not rows:
+            return 0
+
+        vectors = np.asarray(self.embeddings.embed_documents([q for q, _ in rows]), dtype=np.float32)
+        if self.dim is None:
+            self.dim = vectors.shape[1]
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Кластеры построены на векторах размерности {self.dim}, а эмбеддер вернул {vectors.shape[1]}")
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        for vector, (question, campus) in zip(vectors, rows):
+            self._assign(vector, question, campus)
+        return len(rows)
+
+    def top_clusters(self, n: int = 10, min_count: int = 2) -> pd.DataFrame:
+        """
+        Самые частые повторяющиеся вопросы.
+        return: DataFrame с колонками cluster_id, count, exemplar, exemplars, campus_counts.
+        """
+        counts = np.asarray(self.counts)
+        order = [i for i in np.argsort(-counts, kind="stable")[:n] if counts[i] >= min_count]
+        return pd.DataFrame([
+            {
+                "cluster_id": int(i),
+                "count": int(counts[i]),
+                "exemplar": self.exemplars[i][0],
+                "exemplars": list(self.exemplars[i]),
+                "campus_counts": dict(self.campus_counts[i]),
+            }
+            for i in order
+        ], columns=["cluster_id", "count", "exemplar", "exemplars", "campus_counts"])
+
+    def repeat_rate(self) -> float:
+        """Доля вопросов, попавших в кластер, где больше одного вопроса"""
+        total = sum(self.counts)
+        return sum(c for c in self.counts if c > 1) / total if total else 0.0
+
+    def save(self, path: str) -> None:
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path: str, embeddings=None, threshold: Optional[float] = None) -> "QuestionClusterer":
+        """
+        Загружает сохраненное состояние, если файла нет - создает пустой кластеризатор.
+        Состояние должно быть построено тем же эмбеддером, иначе ValueError:
+        центроиды и LSH гиперплоскости другой размерности несовместимы, а порог близости не откалиброван.
+        param threshold: порог близости для новых вопросов, по умолчанию сохраненный (или 0.8 для нового)
+        """
+        if not os.path.exists(path):
+            return cls(embeddings) if threshold is None else cls(embeddings, threshold=threshold)
+        with open(path, "rb") as f:
+            clusterer = pickle.load(f)
+        if not hasattr(clusterer, "embedder"):
+            # состояние, сохраненное до проверки эмбеддера, строилось только на HashingEmbeddings
+            clusterer.embedder = HashingEmbeddings.__name__
+            clusterer.dim = clusterer._planes.shape[-1] if clusterer._planes is not None else None
+        embeddings = embeddings or HashingEmbeddings()
+        embedder = type(embeddings).__name__
+        if clusterer.embedder != embedder:
+            raise ValueError(
+                f"{path} построен с {clusterer.embedder}, а передан {embedder}: удалите файл, чтобы пересчитать кластеры"
+            )
+        if clusterer.dim is not None:
+            dim = len(embeddings.embed_documents(["вопрос"])[0])
+            if dim != clusterer.dim:
+                raise ValueError(
+                    f"{path} построен на векторах размерности {clusterer.dim}, а эмбеддер возвращает {dim}: "
+                    "удалите файл, чтобы пересчитать кластеры"
+                )
+        clusterer.embeddings = embeddings
+        if threshold is not None:
+            clusterer.threshold = threshold
+        return clusterer
+
+
+def load_clusterer(mode: str = "semantic", state_path: Optional[str] = None) -> QuestionClusterer:
+    """
+    Кластеризатор для режима из CLUSTER_MODES со своим порогом и файлом состояния.
+    Порог можно переопределить переменной окружения QUESTION_CLUSTERS_<MODE>_THRESHOLD
+    (например, QUESTION_CLUSTERS_SEMANTIC_THRESHOLD=0.92).
+    Для semantic нужны sentence-transformers и модель E5_MODEL, иначе ImportError / OSError.
+    """
+    if mode not in CLUSTER_MODES:
+        raise ValueError(f"Неизвестный режим кластеризации {mode!r}, доступны {list(CLUSTER_MODES)}")
+    config = CLUSTER_MODES[mode]
+    embeddings = E5Embeddings() if mode == "semantic" else HashingEmbeddings()
+    threshold = float(os.environ.get(f"QUESTION_CLUSTERS_{mode.upper()}_THRESHOLD", config["threshold"]))
+    return QuestionClusterer.load(state_path or config["state_path"], embeddings, threshold=threshold)
@@ -0,0 +1,272 @@
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def collection_fingerprint(vectordb) -> Tuple[Any, ...]:
+    """
+    Отпечаток состояния Chroma коллекции.
+    Меняется при добавлении/удалении чанков или перезаписи chroma.sqlite3,
+    по нему кэш понимает, что сохраненные ответы устарели.
+    """
+    if vectordb is None:
+        return ()
+    if hasattr(vectordb, "fingerprint"):
+        # FlatIndex: число строк и mtime файлов выгрузки
+        return vectordb.fingerprint()
+    collection = getattr(vectordb, "_collection", None)
+    if collection is None:
+        # другие бэкенды без Chroma коллекции
+        return type(vectordb).__name__, len(vectordb)
+    fingerprint = [collection.name, collection.count()]
+    persist_directory = getattr(vectordb, "_persist_directory", None)
+    if persist_directory:
+        sqlite_path = os.path.join(persist_directory, "chroma.sqlite3")
+        if os.path.exists(sqlite_path):
+            fingerprint.append(os.path.getmtime(sqlite_path))
+    return tuple(fingerprint)
+
+
+def _filters_key(user_filters, question_filters) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Ключ фильтров без учета порядка и регистра"""
+    def norm(values):
+        return tuple(sorted({str(v).strip().lower() for v in (values or [])}))
+    return norm(user_filters), norm(question_filters)
+
+
+class _Bucket:
+    """
+    Записи кэша с одинаковыми фильтрами.
+    Векторы лежат в заранее выделенной матрице, записи добавляются в порядке created_at,
+    поэтому устаревшие всегда образуют префикс [0, start) и вытесняются сдвигом start без пересборки матрицы.
+    """
+    def __init__(self, dim: int, capacity: int = 64):
+        self.vectors = np.empty((capacity, dim), dtype=np.float32)
+        self.created_at = np.empty(capacity, dtype=np.float64)
+        self.payloads: List[Optional[Dict[str, Any]]] = [None] * capacity
+        self.start = 0
+        self.end = 0
+
+    def __len__(self) -> int:
+        return self.end - self.start
+
+    def expire(self, deadline: float) -> int:
+        """Вытесняет записи, созданные раньше deadline. return: число вытесненных"""
+        alive_from = self.start + int(np.searchsorted(self.created_at[self.start:self.end], deadline, side="left"))
+        return self.pop_oldest(alive_from - self.start)
+
+    def pop_oldest(self, n: int = 1) -> int:
+        for i in range(self.start, self.start + n):
+            self.payloads[i] = None
+        self.start += n
+        return n
+
+    def append(self, vector: np.ndarray, created_at: float, payload: Dict[str, Any], max_capacity: int) -> None:
+        if self.end == len(self.created_at):
+            capacity = len(self.created_at)
+            # живых записей больше половины - расширяем матрицу, иначе просто сдвигаем их в начало
+            if len(self) * 2 > capacity:
+                capacity = min(capacity * 2, max(max_capacity, capacity + 1))
+            self._resize(capacity)
+        self.vectors[self.end] = vector
+        self.created_at[self.end] = created_at
+        self.payloads[self.end] = payload
+        self.end += 1
+
+    def _resize(self, capacity: int) -> None:
+        n = len(self)
+        vectors = np.empty((capacity, self.vectors.shape[1]), dtype=np.float32)
+        created_at = np.empty(capacity, dtype=np.float64)
+        vectors[:n] = self.vectors[self.start:self.end]
+        created_at[:n] = self.created_at[self.start:self.end]
+        self.payloads = self.payloads[self.start:self.end] + [None] * (capacity - n)
+        self.vectors, self.created_at = vectors, created_at
+        self.start, self.end = 0, n
+
+    def best(self, vector: np.ndarray) -> Tuple[float, Optional[Dict[str, Any]]]:
+        """Ближайшая запись: (косинусная близость, запись)"""
+        if not len(self):
+            return -1.0, None
+        similarities = self.vectors[self.start:self.end] @ vector
+        best = int(np.argmax(similarities))
+        return float(similarities[best]), self.payloads[self.start + best]
+
+
+class SemanticAnswerCache:
+    """
+    Семантический кэш ответов вокруг generate_answer.
+    Ищет ближайший ранее отвеченный вопрос с теми же user_filters / question_filters
+    и, если косинусная близость не ниже порога, возвращает сохраненный ответ и source_documents.
+    Потокобезопасен: generate_answer зовут параллельно (бот, нагрузочный прогон), а store перестраивает бакеты.
+    """
+    def __init__(
+        self,
+        embeddings,
+        threshold: float = 0.95,
+        ttl: float = 24 * 60 * 60,
+        max_size: int = 10000,
+    ):
+        """
+        param embeddings: эмбеддер с методом embed_query (например, embeddings_e5)
+        param threshold: минимальная косинусная близость вопросов для попадания в кэш
+        param ttl: время жизни записи в секундах
+        param max_size: максимальное число записей, при переполнении вытесняются самые старые
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_size = max_size
+
+        # ключ фильтров -> _Bucket с векторами вопросов и записями {answer, source_documents, latency}
+        self._buckets: Dict[Tuple, _Bucket] = {}
+        self._size = 0
+        self._fingerprint: Optional[Tuple] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.latency_saved = 0.0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def embed_query(self, question: str) -> List[float]:
+        """
+        Эмбеддинг вопроса. Его стоит посчитать один раз и передать в lookup / store
+        и в ретривер (create_qa_pipeline(..., query_embedding=...)), чтобы промах кэша не стоил второго эмбеддинга.
+        """
+        return self.embeddings.embed_query(question)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_collection(self, vectordb) -> None:
+        """Сбрасываем кэш, если коллекция Chroma поменялась"""
+        if vectordb is None:
+            return
+        fingerprint = collection_fingerprint(vectordb)
+        if self._fingerprint is not None and fingerprint != self._fingerprint:
+            self._clear()
+        self._fingerprint = fingerprint
+
+    def _expire(self, key: Tuple, now: float) -> Optional[_Bucket]:
+        """Ленивое вытеснение по TTL: только в бакете, к которому обращаемся"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            return None
+        evicted = bucket.expire(now - self.ttl)
+        self._size -= evicted
+        self.evictions += evicted
+        if not len(bucket):
+            del self._buckets[key]
+            return None
+        return bucket
+
+    def _evict_oldest(self) -> None:
+        while self._size > self.max_size:
+            key = min(self._buckets, key=lambda k: self._buckets[k].created_at[self._buckets[k].start])
+            self._size -= self._buckets[key].pop_oldest()
+            self.evictions += 1
+            if not len(self._buckets[key]):
+                del self._buckets[key]
+
+    def lookup(
+        self,
+        question: str,
+        user_filters: Optional[List[str]] = None,
+        question_filters: Optional[List[str]] = None,
+        vectordb=None,
+        embedding: Optional[List[float]] = None,
+    ) -> Optional[Tuple[str, list]]:
+        """
+        Поиск ответа в кэше.
+        param embedding: готовый эмбеддинг вопроса (embed_query), иначе считается здесь
+        return: (answer, source_documents) при попадании, иначе None.
+        """
+        start = time.perf_counter()
+        # эмбеддинг считаем до блокировки, чтобы параллельные запросы не ждали модель друг друга
+        if embedding is None:
+            embedding = self.embed_query(question)
+        vector = self._normalize(embedding)
+
+        with self._lock:
+            self._check_collection(vectordb)
+            bucket = self._expire(_filters_key(user_filters, question_filters), time.time())
+            if bucket is None:
+                self.misses += 1
+                return None
+
+            similarity, entry = bucket.best(vector)
+            if similarity < self.threshold:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.latency_saved += max(entry["latency"] - (time.perf_counter() - start), 0.0)
+            return entry["answer"], entry["source_documents"]
+
+    def store(
+        self,
+        question: str,
+        answer: str,
+        source_documents: list,
+        user_filters: Optional[List[str]] = None,
+        question_filters: Optional[List[str]] = None,
+        latency: float = 0.0,
+        vectordb=None,
+        embedding: Optional[List[float]] = None,
+    ) -> None:
+        """
+        Сохраняет ответ в кэш.
+        param latency: сколько секунд заняла полная генерация ответа (для статистики сэкономленного времени)
+        param embedding: эмбеддинг вопроса, посчитанный для lookup
+        """
+        if embedding is None:
+            embedding = self.embed_query(question)
+        vector = self._normalize(embedding)
+        key = _filters_key(user_filters, question_filters)
+        with self._lock:
+            self._check_collection(vectordb)
+            now = time.time()
+            bucket = self._expire(key, now)
+            if bucket is None:
+                bucket = self._buckets[key] = _Bucket(len(vector))
+            bucket.append(
+                vector, now,
+                {"answer": answer, "source_documents": source_documents, "latency": latency},
+                self.max_size,
+            )
+            self._size += 1
+            self._evict_oldest()
+
+    def _clear(self) -> None:
+        self._buckets.clear()
+        self._size = 0
+        self.invalidations += 1
+
+    def invalidate(self) -> None:
+        """Полная очистка кэша"""
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> Dict[str, float]:
+        """Статистика: hit rate, сэкономленное время и размер кэша"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "latency_saved_sec": self.latency_saved,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
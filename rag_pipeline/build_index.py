@@ -0,0 +1,279 @@
+"""
+Сборка и инкрементальное обновление Chroma индекса из DOCX/PDF документов.
+
+Запуск из папки rag_pipeline:
+    python build_index.py --docs-dir ../documents --persist-directory chroma
+
+Повторный запуск переэмбеддит только изменившиеся файлы (по sha256 содержимого и метаданных из --metadata),
+чанки удаленных файлов убираются из коллекции.
+Если коллекция уже не пустая, а index_manifest.json нет (например, rag_pipeline/chroma из репозитория),
+сборка останавливается: пересобрать коллекцию с нуля можно флагом --rebuild.
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain.text_splitter import TokenTextSplitter
+from langchain.vectorstores import Chroma
+from langchain_community.document_loaders import Docx2txtLoader, PyPDFLoader
+
+from retrieval import with_membership_keys
+
+LOADERS = {
+    ".docx": Docx2txtLoader,
+    ".pdf": PyPDFLoader,
+}
+MANIFEST_NAME = "index_manifest.json"
+
+
+def file_hash(path: Path) -> str:
+    """sha256 содержимого файла"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def metadata_hash(metadata: Dict[str, Any]) -> str:
+    """sha256 метаданных файла из --metadata: смена тегов тоже требует переиндексации"""
+    return hashlib.sha256(json.dumps(metadata, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _file_metadata(
+    extra_metadata: Dict[str, Dict[str, Any]], rel_path: str, files: Dict[str, Path]
+) -> Dict[str, Any]:
+    """
+    Метаданные файла ищутся по пути относительно docs_dir.
+    Ключ-имя файла (старый формат) подходит, только если файл с таким именем один.
+    """
+    if rel_path in extra_metadata:
+        return extra_metadata[rel_path]
+    name = files[rel_path].name
+    if sum(p.name == name for p in files.values()) == 1:
+        return extra_metadata.get(name, {})
+    return {}
+
+
+def _load_and_split(
+    path: str,
+    rel_path: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    extra_metadata: Dict[str, Any],
+) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    Загрузка и нарезка одного файла. Выполняется в отдельном процессе,
+    поэтому возвращает простые (text, metadata), а не Document.
+    """
+    loader = LOADERS[Path(path).suffix.lower()](path)
+    splitter = TokenTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunks = []
+    for doc in splitter.split_documents(loader.load()):
+        metadata = {k: v for k, v in doc.metadata.items() if isinstance(v, (str, int, float, bool))}
+        metadata.update(extra_metadata)
+        metadata["source_path"] = rel_path
+        metadata.setdefault("file_name", Path(path).name)
+        # ключи принадлежности user_tag:<тег> / topic_tag:<тег> для префильтра FilteredMMRRetriever
+        chunks.append((doc.page_content, with_membership_keys(metadata)))
+    return chunks
+
+
+def _load_manifest(persist_directory: str) -> Dict[str, Dict[str, Any]]:
+    path = os.path.join(persist_directory, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_manifest(persist_directory: str, manifest: Dict[str, Dict[str, Any]]) -> None:
+    with open(os.path.join(persist_directory, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+
+
+def create_vectordb(
+    docs_dir: str,
+    persist_directory: str,
+    embeddings,
+    chunk_size: int = 256,
+    chunk_overlap: int = 32,
+    batch_size: int = 256,
+    workers: Optional[int] = None,
+    metadata_path: Optional[str] = None,
+    rebuild: bool = False,
+) -> Dict[str, Any]:
+    """
+    Создает или обновляет Chroma в persist_directory по документам из docs_dir.
+    param embeddings: эмбеддер (например, embeddings_e5), embed_documents вызывается батчами по batch_size
+    param workers: число процессов для загрузки и нарезки (по умолчанию os.cpu_count())
+    param metadata_path: json {путь относительно docs_dir: метаданные}, например topic_tag_* / user_tag_* / url
+    param rebuild: удалить коллекцию и собрать заново (нужно для коллекции без index_manifest.json)
+    return: статистика: сколько файлов переиндексировано, удалено, не загрузилось, чанков, docs/sec и chunks/sec.
+    Старые чанки удаляются только после upsert новых, так что при ошибке эмбеддинга коллекция остается прежней,
+    а файлы, которые не удалось загрузить, сохраняют старые чанки и попадают в failed.
+    """
+    start = time.perf_counter()
+    os.makedirs(persist_directory, exist_ok=True)
+    extra_metadata = {}
+    if metadata_path:
+        with open(metadata_path, "r", encoding="utf-8") as f:
+            extra_metadata = json.load(f)
+
+    files = {
+        p.relative_to(docs_dir).as_posix(): p
+        for p in sorted(Path(docs_dir).rglob("*"))
+        if p.is_file() and p.suffix.lower() in LOADERS
+    }
+    vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+    manifest = _load_manifest(persist_directory)
+    if rebuild:
+        vectordb.delete_collection()
+        vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+        manifest = {}
+    elif not manifest and vectordb._collection.count():
+        raise RuntimeError(
+            f"В {persist_directory} уже есть {vectordb._collection.count()} чанков, но нет {MANIFEST_NAME}: "
+            "инкрементальная сборка добавила бы вторую копию документов. Используйте rebuild=True (--rebuild)."
+        )
+    collection = vectordb._collection
+
+    hashes = {rel_path: file_hash(p) for rel_path, p in files.items()}
+    file_metadata = {rel_path: _file_metadata(extra_metadata, rel_path, files) for rel_path in files}
+    metadata_hashes = {rel_path: metadata_hash(m) for rel_path, m in file_metadata.items()}
+    # записи манифеста без metadata_sha256 (до учета метаданных) переиндексируются один раз
+    changed = [
+        rel_path for rel_path, h in hashes.items()
+        if manifest.get(rel_path, {}).get("sha256") != h
+        or manifest.get(rel_path, {}).get("metadata_sha256") != metadata_hashes[rel_path]
+    ]
+    removed = [rel_path for rel_path in manifest if rel_path not in files]
+
+    n_chunks = 0
+    failed: Dict[str, str] = {}
+    reindexed: Dict[str, Dict[str, Any]] = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            rel_path: pool.submit(
+                _load_and_split, str(files[rel_path]), rel_path, chunk_size, chunk_overlap, file_metadata[rel_path],
+            )
+            for rel_path in changed
+        }
+        texts, metadatas, ids = [], [], []
+
+        def flush():
+            if texts:
+                collection.upsert(
+                    ids=list(ids),
+                    embeddings=embeddings.embed_documents(texts),
+                    metadatas=list(metadatas),
+                    documents=list(texts),
+                )
+                texts.clear()
+                metadatas.clear()
+                ids.clear()
+
+        for rel_path, future in futures.items():
+            try:
+                chunks = future.result()
+            except Exception as e:
+                # битый файл не должен ронять всю сборку, его старые чанки остаются в коллекции
+                failed[rel_path] = f"{type(e).__name__}: {e}"
+                continue
+            # id зависит от пути, содержимого и метаданных: одинаковые файлы в разных папках не пересекаются,
+            # а при смене тегов пишутся новые чанки (upsert в Chroma не удаляет старые ключи метаданных)
+            prefix = "-".join([
+                hashlib.sha256(rel_path.encode("utf-8")).hexdigest()[:12],
+                hashes[rel_path][:12],
+                metadata_hashes[rel_path][:8],
+            ])
+            chunk_ids = []
+            for n, (text, metadata) in enumerate(chunks):
+                chunk_ids.append(f"{prefix}-{n}")
+                texts.append(text)
+                metadatas.append(metadata)
+                ids.append(chunk_ids[-1])
+                if len(texts) >= batch_size:
+                    flush()
+            reindexed[rel_path] = {
+                "sha256": hashes[rel_path],
+                "metadata_sha256": metadata_hashes[rel_path],
+                "chunk_ids": chunk_ids,
+            }
+            n_chunks += len(chunk_ids)
+        flush()
+
+    # старые чанки переиндексированных и удаленных файлов убираем только после того, как новые записаны
+    new_ids = {i for entry in reindexed.values() for i in entry["chunk_ids"]}
+    stale_ids = sorted(
+        i for rel_path in list(reindexed) + removed
+        for i in manifest.get(rel_path, {}).get("chunk_ids", []) if i not in new_ids
+    )
+    for i in range(0, len(stale_ids), batch_size):
+        collection.delete(ids=stale_ids[i:i + batch_size])
+    for rel_path in removed:
+        del manifest[rel_path]
+    manifest.update(reindexed)
+
+    _save_manifest(persist_directory, manifest)
+    elapsed = time.perf_counter() - start
+    return {
+        "files_total": len(files),
+        "files_reindexed": len(reindexed),
+        "files_removed": len(removed),
+        "files_failed": len(failed),
+        "failed": failed,
+        "chunks": n_chunks,
+        "seconds": elapsed,
+        "docs_per_sec": len(reindexed) / elapsed if elapsed else 0.0,
+        "chunks_per_sec": n_chunks / elapsed if elapsed else 0.0,
+    }
+
+
+def main():
+    from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+
+    parser = argparse.ArgumentParser(description="Инкрементальная сборка Chroma индекса из DOCX/PDF")
+    parser.add_argument("--docs-dir", required=True, help="папка с документами")
+    parser.add_argument("--persist-directory", default=os.path.join(os.path.dirname(__file__), "chroma"))
+    parser.add_argument("--chunk-size", type=int, default=256)
+    parser.add_argument("--chunk-overlap", type=int, default=32)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--metadata", default=None, help="json {путь относительно docs-dir: метаданные}")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--rebuild", action="store_true", help="удалить коллекцию и собрать заново")
+    args = parser.parse_args()
+
+    embeddings_e5 = HuggingFaceEmbeddings(
+        model_name="intfloat/multilingual-e5-large",
+        model_kwargs={"device": args.device},
+        encode_kwargs={"normalize_embeddings": True, "batch_size": args.batch_size},
+    )
+    stats = create_vectordb(
+        args.docs_dir,
+        args.persist_directory,
+        embeddings_e5,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        metadata_path=args.metadata,
+        rebuild=args.rebuild,
+    )
+    print(
+        f"Файлов: {stats['files_total']}, переиндексировано: {stats['files_reindexed']}, "
+        f"удалено: {stats['files_removed']}, чанков: {stats['chunks']}\n"
+        f"{stats['seconds']:.1f} сек, {stats['docs_per_sec']:.2f} docs/sec, {stats['chunks_per_sec']:.1f} chunks/sec"
+    )
+    for rel_path, error in stats["failed"].items():
+        print(f"Не удалось загрузить {rel_path}: {error}")
+
+
+if __name__ == "__main__":
+    main()
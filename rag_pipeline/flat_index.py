@@ -0,0 +1,385 @@
+"""
+Плоский индекс: матрица эмбеддингов в memory-mapped .npy и компактная таблица метаданных.
+Альтернатива Chroma/HNSW для быстрого старта воркеров и офлайн-оценки на тысячах вопросов:
+поиск точный (детерминированный) и батчевый, через матричные произведения NumPy.
+
+Экспорт из папки rag_pipeline:
+    python flat_index.py export --persist-directory chroma --output flat_index --dtype float16
+Бенчмарк старта и пропускной способности против Chroma:
+    python flat_index.py bench --persist-directory chroma --index-dir flat_index --queries 1000
+"""
+import argparse
+import json
+import os
+import time
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from retrieval import TOPIC_TAG_PREFIX, USER_TAG_PREFIX, chunk_tags, normalize_tag
+
+EMBEDDINGS_FILE = "embeddings.npy"
+METADATA_FILE = "metadata.jsonl"
+
+
+def export_chroma(vectordb, output_dir: str, dtype: str = "float16", batch_size: int = 5000) -> int:
+    """
+    Выгружает коллекцию Chroma в output_dir:
+      - embeddings.npy - матрица (n, dim) float32/float16, нормированная по строкам;
+      - metadata.jsonl - по строке {"id", "text", "metadata"} на чанк, в том же порядке.
+    return: число выгруженных чанков.
+    """
+    collection = vectordb._collection
+    total = collection.count()
+    os.makedirs(output_dir, exist_ok=True)
+
+    matrix = None
+    with open(os.path.join(output_dir, METADATA_FILE), "w", encoding="utf-8") as f:
+        for offset in range(0, total, batch_size):
+            batch = collection.get(
+                limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"]
+            )
+            vectors = np.asarray(batch["embeddings"], dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            if matrix is None:
+                matrix = np.lib.format.open_memmap(
+                    os.path.join(output_dir, EMBEDDINGS_FILE), mode="w+",
+                    dtype=np.dtype(dtype), shape=(total, vectors.shape[1]),
+                )
+            matrix[offset:offset + len(vectors)] = vectors
+            for id_, text, metadata in zip(batch["ids"], batch["documents"], batch["metadatas"]):
+                f.write(json.dumps({"id": id_, "text": text, "metadata": metadata or {}}, ensure_ascii=False) + "\n")
+    if matrix is not None:
+        matrix.flush()
+    return total
+
+
+class FlatIndex:
+    """
+    Точный поиск по memory-mapped матрице эмбеддингов.
+    Матрица не читается целиком при открытии, страницы подгружаются ОС по мере обращения.
+    """
+    def __init__(self, index_dir: str, embeddings=None):
+        """
+        param index_dir: папка, созданная export_chroma
+        param embeddings: эмбеддер для текстовых запросов (тот же, что при сборке Chroma)
+        """
+        self.embeddings = embeddings
+        self.index_dir = index_dir
+        self.matrix = np.load(os.path.join(index_dir, EMBEDDINGS_FILE), mmap_mode="r")
+        self.ids: List[str] = []
+        self.texts: List[str] = []
+        self.metadatas: List[Dict[str, Any]] = []
+        with open(os.path.join(index_dir, METADATA_FILE), "r", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                self.ids.append(row["id"])
+                self.texts.append(row["text"])
+                self.metadatas.append(row["metadata"])
+        # тег -> номера строк с ним, для префильтра как в FilteredMMRRetriever
+        tag_rows: Dict[Tuple[str, str], List[int]] = {}
+        for i, metadata in enumerate(self.metadatas):
+            for prefix in (USER_TAG_PREFIX, TOPIC_TAG_PREFIX):
+                for tag in chunk_tags(metadata, prefix):
+                    tag_rows.setdefault((prefix, tag), []).append(i)
+        self._tag_rows: Dict[Tuple[str, str], np.ndarray] = {
+            key: np.asarray(rows, dtype=np.int64) for key, rows in tag_rows.items()
+        }
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def fingerprint(self) -> Tuple[Any, ...]:
+        """Отпечаток выгрузки для SemanticAnswerCache: меняется при повторном export_chroma, даже с тем же числом строк"""
+        files = [os.path.join(self.index_dir, name) for name in (EMBEDDINGS_FILE, METADATA_FILE)]
+        return (type(self).__name__, len(self)) + tuple(
+            (os.path.getmtime(path), os.path.getsize(path)) if os.path.exists(path) else None for path in files
+        )
+
+    def _document(self, i: int) -> Document:
+        return Document(page_content=self.texts[i], metadata=self.metadatas[i])
+
+    def filter_rows(
+        self,
+        user_filters: Optional[List[str]] = None,
+        question_filters: Optional[List[str]] = None,
+        min_candidates: int = 1,
+    ) -> Optional[np.ndarray]:
+        """
+        Строки, подходящие под тот же предикат, что и build_metadata_filter:
+        каждый из user_filters среди user_tag_*, хотя бы один из question_filters среди topic_tag_*.
+        return: отсортированные номера строк или None (без фильтра или если подошло меньше min_candidates строк).
+        """
+        empty = np.empty(0, dtype=np.int64)
+        rows = None
+        for value in dict.fromkeys(v for v in (user_filters or []) if v):
+            tagged = self._tag_rows.get((USER_TAG_PREFIX, normalize_tag(value)), empty)
+            rows = tagged if rows is None else np.intersect1d(rows, tagged, assume_unique=True)
+        topics = [v for v in dict.fromkeys(question_filters or []) if v]
+        if topics:
+            tagged = np.unique(np.concatenate(
+                [self._tag_rows.get((TOPIC_TAG_PREFIX, normalize_tag(value)), empty) for value in topics]
+            ))
+            rows = tagged if rows is None else np.intersect1d(rows, tagged, assume_unique=True)
+        if rows is None or len(rows) < min_candidates:
+            return None
+        return rows
+
+    def _top_k(
+        self,
+        queries: np.ndarray,
+        k: int,
+        rows: Optional[np.ndarray] = None,
+        chunk_size: int = 16384,
+        query_batch: int = 256,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k по косинусной близости: (индексы, близости) формы (n_queries, k), по убыванию близости.
+        Матрица читается блоками по chunk_size строк, запросы идут батчами по query_batch,
+        в памяти держится только текущий блок близостей и текущий top-k, а не матрица (n_queries, n_docs).
+        param rows: искать только среди этих строк (filter_rows)
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        n_rows = len(self) if rows is None else len(rows)
+        k = min(k, n_rows)
+        top_idx = np.empty((len(queries), k), dtype=np.int64)
+        top_scores = np.empty((len(queries), k), dtype=np.float32)
+        for q_start in range(0, len(queries), query_batch):
+            batch = queries[q_start:q_start + query_batch]
+            best_idx = np.empty((len(batch), 0), dtype=np.int64)
+            best_scores = np.empty((len(batch), 0), dtype=np.float32)
+            for start in range(0, n_rows, chunk_size):
+                if rows is None:
+                    idx = np.arange(start, min(start + chunk_size, n_rows))
+                    block = self.matrix[start:start + chunk_size]
+                else:
+                    idx = rows[start:start + chunk_size]
+                    block = self.matrix[idx]
+                scores = batch @ np.asarray(block, dtype=np.float32).T
+                if scores.shape[1] > k:
+                    keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                    scores, idx = np.take_along_axis(scores, keep, axis=1), idx[keep]
+                else:
+                    idx = np.broadcast_to(idx, scores.shape)
+                # сливаем top-k блока с текущим top-k, дальше снова оставляем k лучших
+                best_scores = np.concatenate([best_scores, scores], axis=1)
+                best_idx = np.concatenate([best_idx, idx], axis=1)
+                if best_scores.shape[1] > k:
+                    keep = np.argpartition(-best_scores, k - 1, axis=1)[:, :k]
+                    best_scores = np.take_along_axis(best_scores, keep, axis=1)
+                    best_idx = np.take_along_axis(best_idx, keep, axis=1)
+            order = np.argsort(-best_scores, axis=1)
+            top_idx[q_start:q_start + len(batch)] = np.take_along_axis(best_idx, order, axis=1)
+            top_scores[q_start:q_start + len(batch)] = np.take_along_axis(best_scores, order, axis=1)
+        return top_idx, top_scores
+
+    def search_by_vectors(
+        self,
+        queries: np.ndarray,
+        k: int = 4,
+        user_filters: Optional[List[str]] = None,
+        question_filters: Optional[List[str]] = None,
+    ) -> List[List[Document]]:
+        """Батчевый top-k для матрицы эмбеддингов запросов (n_queries, dim), фильтры общие для всего батча"""
+        top, _ = self._top_k(queries, k, self.filter_rows(user_filters, question_filters, k))
+        return [[self._document(i) for i in row] for row in top]
+
+    def mmr_by_vectors(
+        self,
+        queries: np.ndarray,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = .6,
+        user_filters: Optional[List[str]] = None,
+        question_filters: Optional[List[str]] = None,
+        min_candidates: Optional[int] = None,
+        query_batch: int = 256,
+    ) -> List[List[Document]]:
+        """
+        Батчевый MMR: для батча запросов берем fetch_k кандидатов блочным матричным произведением,
+        затем жадно выбираем k документов по lambda * sim(q, d) - (1 - lambda) * max sim(d, выбранные).
+        Как и FilteredMMRRetriever, ищем только по строкам с подходящими тегами,
+        а если их меньше min_candidates (по умолчанию k) - по всему индексу.
+        Запросы обрабатываются батчами по query_batch, так что память не растет с числом вопросов.
+        """
+        allowed = self.filter_rows(user_filters, question_filters, min_candidates if min_candidates is not None else k)
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        documents = []
+        for start in range(0, len(queries), query_batch):
+            chosen = self._mmr(queries[start:start + query_batch], k, fetch_k, lambda_mult, allowed)
+            documents.extend([self._document(i) for i in row] for row in chosen)
+        return documents
+
+    def _mmr(
+        self, queries: np.ndarray, k: int, fetch_k: int, lambda_mult: float, allowed: Optional[np.ndarray]
+    ) -> np.ndarray:
+        """MMR для одного батча запросов: индексы выбранных строк (n_queries, k)"""
+        candidates, relevance = self._top_k(queries, fetch_k, allowed)
+        vectors = np.asarray(self.matrix[candidates], dtype=np.float32)
+        redundancy = np.einsum("qid,qjd->qij", vectors, vectors)
+
+        rows = np.arange(len(candidates))
+        k = min(k, candidates.shape[1])
+        selected = np.zeros((len(candidates), k), dtype=np.int64)
+        taken = np.zeros(candidates.shape, dtype=bool)
+        taken[:, 0] = True
+        max_sim = redundancy[:, 0].copy()
+        for step in range(1, k):
+            mmr = lambda_mult * relevance - (1 - lambda_mult) * max_sim
+            mmr[taken] = -np.inf
+            best = np.argmax(mmr, axis=1)
+            selected[:, step] = best
+            taken[rows, best] = True
+            max_sim = np.maximum(max_sim, redundancy[rows, best])
+
+        # как в Chroma и FilteredMMRRetriever: документы в порядке близости к запросу, а не в порядке выбора MMR
+        # (кандидаты отсортированы по близости, поэтому достаточно отсортировать их номера)
+        return np.take_along_axis(candidates, np.sort(selected, axis=1), axis=1)
+
+    def _embed(self, questions: Sequence[str]) -> np.ndarray:
+        assert self.embeddings is not None, "Для текстовых запросов передайте embeddings в FlatIndex"
+        # embed_query, как в Chroma ретривере: у части эмбеддеров запросы и документы кодируются по-разному
+        return np.asarray([self.embeddings.embed_query(q) for q in questions], dtype=np.float32)
+
+    def batch_search(
+        self,
+        questions: Sequence[str],
+        k: int = 4,
+        user_filters: Optional[List[str]] = None,
+        question_filters: Optional[List[str]] = None,
+    ) -> List[List[Document]]:
+        return self.search_by_vectors(self._embed(questions), k, user_filters, question_filters)
+
+    def batch_mmr(
+        self,
+        questions: Sequence[str],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = .6,
+        user_filters: Optional[List[str]] = None,
+        question_filters: Optional[List[str]] = None,
+    ) -> List[List[Document]]:
+        return self.mmr_by_vectors(self._embed(questions), k, fetch_k, lambda_mult, user_filters, question_filters)
+
+    def as_retriever(self, **kwargs) -> "FlatRetriever":
+        return FlatRetriever(index=self, **kwargs)
+
+
+class FlatRetriever(BaseRetriever):
+    """Ретривер поверх FlatIndex, подставляется в create_qa_pipeline вместо Chroma ретривера"""
+    index: Any
+    search_type: str = "mmr"
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = .6
+    # префильтр по тегам, как в FilteredMMRRetriever
+    user_filters: List[str] = []
+    question_filters: List[str] = []
+    min_candidates: Optional[int] = None
+    # эмбеддинг запроса, если он уже посчитан (например, SemanticAnswerCache.embed_query при промахе кэша)
+    query_embedding: Optional[List[float]] = None
+    # PipelineTrace из tracing.py, если нужно замерить этапы embedding / retrieval
+    trace: Any = None
+
+    def _stage(self, name: str):
+        return self.trace.stage(name) if self.trace is not None else nullcontext()
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.query_embedding is not None:
+            vectors = np.asarray([self.query_embedding], dtype=np.float32)
+        else:
+            with self._stage("embedding"):
+                vectors = self.index._embed([query])
+        with self._stage("retrieval"):
+            if self.search_type == "mmr":
+                return self.index.mmr_by_vectors(
+                    vectors, self.k, self.fetch_k, self.lambda_mult,
+                    self.user_filters, self.question_filters, self.min_candidates,
+                )[0]
+            return self.index.search_by_vectors(vectors, self.k, self.user_filters, self.question_filters)[0]
+
+
+def benchmark(
+    persist_directory: str,
+    index_dir: str,
+    n_queries: int = 1000,
+    k: int = 4,
+    fetch_k: int = 20,
+    seed: int = 0,
+    embeddings=None,
+) -> Dict[str, float]:
+    """
+    Сравнение с Chroma: время открытия хранилища и пропускная способность MMR.
+    Запросы - случайные векторы, чтобы не мерить модель эмбеддингов.
+    """
+    from langchain.vectorstores import Chroma
+
+    start = time.perf_counter()
+    vectordb = Chroma(persist_directory=persist_directory, embedding_function=embeddings)
+    vectordb._collection.count()
+    chroma_startup = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index = FlatIndex(index_dir)
+    flat_startup = time.perf_counter() - start
+
+    rng = np.random.default_rng(seed)
+    queries = rng.standard_normal((n_queries, index.matrix.shape[1])).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    for q in queries:
+        vectordb.max_marginal_relevance_search_by_vector(q.tolist(), k=k, fetch_k=fetch_k, lambda_mult=.6)
+    chroma_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    index.mmr_by_vectors(queries, k=k, fetch_k=fetch_k, lambda_mult=.6)
+    flat_seconds = time.perf_counter() - start
+
+    return {
+        "chunks": len(index),
+        "queries": n_queries,
+        "chroma_startup_sec": chroma_startup,
+        "flat_startup_sec": flat_startup,
+        "chroma_qps": n_queries / chroma_seconds,
+        "flat_qps": n_queries / flat_seconds,
+    }
+
+
+def main():
+    from langchain.vectorstores import Chroma
+
+    parser = argparse.ArgumentParser(description="Плоский memory-mapped индекс поверх выгрузки Chroma")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="выгрузить Chroma в плоский индекс")
+    export_parser.add_argument("--persist-directory", default="chroma")
+    export_parser.add_argument("--output", default="flat_index")
+    export_parser.add_argument("--dtype", choices=["float32", "float16"], default="float16")
+    bench_parser = subparsers.add_parser("bench", help="сравнить старт и пропускную способность с Chroma")
+    bench_parser.add_argument("--persist-directory", default="chroma")
+    bench_parser.add_argument("--index-dir", default="flat_index")
+    bench_parser.add_argument("--queries", type=int, default=1000)
+    bench_parser.add_argument("--output", help="путь для сохранения результатов в JSON")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        start = time.perf_counter()
+        n = export_chroma(Chroma(persist_directory=args.persist_directory), args.output, args.dtype)
+        print(f"Выгружено {n} чанков в {args.output} за {time.perf_counter() - start:.1f} сек")
+    else:
+        result = benchmark(args.persist_directory, args.index_dir, args.queries)
+        print(json.dumps(result, indent=4))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,295 @@
+import json
+import threading
+from collections import OrderedDict
+from contextlib import nullcontext
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from answer_cache import collection_fingerprint
+
+# Теги в метаданных чанков позиционные: topic_tag_1..N, user_tag_1..N.
+# В текущей коллекции максимум ~12 слотов, берем с запасом (только для коллекций без ключей принадлежности).
+MAX_TAG_SLOTS = 16
+USER_TAG_PREFIX = "user_tag_"
+TOPIC_TAG_PREFIX = "topic_tag_"
+
+
+def normalize_tag(value: Any) -> str:
+    return str(value).strip().lower()
+
+
+def membership_key(prefix: str, value: Any) -> str:
+    """
+    Ключ принадлежности тега: user_tag:москва = True.
+    Фильтр по нему - один $eq вместо $or по всем позиционным слотам.
+    """
+    return f"{prefix.rstrip('_')}:{normalize_tag(value)}"
+
+
+def chunk_tags(metadata: Dict[str, Any], prefix: str) -> Set[str]:
+    """Нормализованные значения позиционных тегов prefix1..N чанка"""
+    return {
+        normalize_tag(value) for key, value in metadata.items()
+        if key.startswith(prefix) and key[len(prefix):].isdigit() and value
+    }
+
+
+def with_membership_keys(metadata: Dict[str, Any]) -> Dict[str, Any]:
+    """Метаданные чанка с добавленными ключами принадлежности для всех user_tag_* / topic_tag_*"""
+    metadata = dict(metadata)
+    for prefix in (USER_TAG_PREFIX, TOPIC_TAG_PREFIX):
+        for tag in chunk_tags(metadata, prefix):
+            metadata[membership_key(prefix, tag)] = True
+    return metadata
+
+
+def add_membership_keys(vectordb, batch_size: int = 5000) -> int:
+    """
+    Миграция существующей коллекции Chroma: дописывает ключи принадлежности в метаданные чанков.
+    Эмбеддинги не пересчитываются. Новые чанки получают ключи при сборке (build_index.create_vectordb).
+    return: число обновленных чанков.
+    """
+    collection = vectordb._collection
+    updated = 0
+    for offset in range(0, collection.count(), batch_size):
+        batch = collection.get(limit=batch_size, offset=offset, include=["metadatas"])
+        ids, metadatas = [], []
+        for id_, metadata in zip(batch["ids"], batch["metadatas"]):
+            migrated = with_membership_keys(metadata or {})
+            if migrated != metadata:
+                ids.append(id_)
+                metadatas.append(migrated)
+        if ids:
+            collection.update(ids=ids, metadatas=metadatas)
+            updated += len(ids)
+    return updated
+
+
+def _clean(values: Optional[List[str]]) -> List[str]:
+    return [value for value in dict.fromkeys(values or []) if value]
+
+
+def _slot_variants(values: List[str]) -> List[str]:
+    """
+    Варианты написания тегов для позиционных слотов.
+    В слотах лежат исходные значения ("Москва", "ГИА"), а where в Chroma сравнивает строки точно,
+    поэтому к значению добавляются нормализованное и его типичные написания.
+    Для произвольного регистра нужны ключи принадлежности (add_membership_keys).
+    """
+    variants = []
+    for value in values:
+        norm = normalize_tag(value)
+        variants += [str(value).strip(), norm, norm[:1].upper() + norm[1:], norm.title(), norm.upper()]
+    return list(dict.fromkeys(variants))
+
+
+def _any_slot(prefix: str, values: List[str], max_tag_slots: int) -> Dict[str, Any]:
+    """Условие: хотя бы один слот prefix_i содержит одно из values (без учета регистра, см. _slot_variants)"""
+    values = _slot_variants(values)
+    condition = {"$in": values} if len(values) > 1 else {"$eq": values[0]}
+    clauses = [{f"{prefix}{i}": condition} for i in range(1, max_tag_slots + 1)]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def _any_member(prefix: str, values: List[str]) -> Dict[str, Any]:
+    """Условие: у чанка есть ключ принадлежности хотя бы для одного из values"""
+    clauses = [{membership_key(prefix, value): True} for value in dict.fromkeys(map(normalize_tag, values))]
+    return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+
+def build_metadata_filter(
+    user_filters: Optional[List[str]] = None,
+    question_filters: Optional[List[str]] = None,
+    max_tag_slots: int = MAX_TAG_SLOTS,
+    membership_keys: bool = True,
+) -> Optional[Dict[str, Any]]:
+    """
+    Собирает where-фильтр Chroma по тегам чанков.
+    - каждый из user_filters (кампус, уровень образования) должен быть среди user_tag_*;
+    - хотя бы один из question_filters (категории вопроса) должен быть среди topic_tag_*.
+    param membership_keys: фильтровать по ключам принадлежности (add_membership_keys),
+                           False - по позиционным слотам для старых коллекций (в разы медленнее)
+    return: where-фильтр или None, если фильтровать не по чему.
+    """
+    if membership_keys:
+        conditions = [_any_member(USER_TAG_PREFIX, [value]) for value in _clean(user_filters)]
+    else:
+        conditions = [_any_slot(USER_TAG_PREFIX, [value], max_tag_slots) for value in _clean(user_filters)]
+    topics = _clean(question_filters)
+    if topics:
+        if membership_keys:
+            conditions.append(_any_member(TOPIC_TAG_PREFIX, topics))
+        else:
+            conditions.append(_any_slot(TOPIC_TAG_PREFIX, topics, max_tag_slots))
+
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+
+class _Candidates:
+    """Чанки под один where-фильтр: нормированная матрица эмбеддингов, тексты и метаданные"""
+    def __init__(self, embeddings, documents: List[str], metadatas: List[Dict[str, Any]]):
+        if documents:
+            matrix = np.asarray(embeddings, dtype=np.float32).reshape(len(documents), -1)
+        else:
+            # под фильтр ничего не нашлось (или у коллекции нет ключей принадлежности)
+            matrix = np.empty((0, 0), dtype=np.float32)
+        self.matrix = matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self.documents = documents
+        self.metadatas = metadatas
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+
+class CandidateCache:
+    """
+    Чанки, подходящие под where-фильтр, вместе с эмбеддингами.
+    Фильтр по метаданным в Chroma - это проход по метаданным всей коллекции, и он стоит дороже самого поиска,
+    а различных комбинаций кампус / уровень / категории немного. Поэтому where выполняется один раз на фильтр,
+    а дальше top-fetch_k и MMR считаются в NumPy по небольшой матрице кандидатов.
+    Записи привязаны к отпечатку коллекции и устаревают вместе с ней.
+    Память: max_rows * размерность * 4 байта, для e5-large (1024) и 20000 чанков - около 80 МБ.
+    """
+    def __init__(self, max_rows: int = 20000, max_rows_per_filter: Optional[int] = None):
+        """
+        param max_rows: сколько чанков суммарно держать в кэше, при переполнении вытесняются давно не нужные
+        param max_rows_per_filter: фильтры, под которые подходит больше чанков, не кэшируются
+                                   (поиск идет через where в Chroma), по умолчанию max_rows // 4
+        """
+        self.max_rows = max_rows
+        self.max_rows_per_filter = max_rows_per_filter if max_rows_per_filter is not None else max(max_rows // 4, 1)
+        self._entries: "OrderedDict[Tuple, _Candidates]" = OrderedDict()
+        self._too_broad: Set[Tuple] = set()
+        self._rows = 0
+        self._lock = threading.Lock()
+
+    def get(self, vectorstore, where: Dict[str, Any]) -> Optional[_Candidates]:
+        """
+        Кандидаты под фильтр.
+        return: None, если фильтр слишком широкий для кэша (больше max_rows_per_filter чанков).
+        """
+        key = (collection_fingerprint(vectorstore), json.dumps(where, sort_keys=True, ensure_ascii=False))
+        with self._lock:
+            if key in self._too_broad:
+                return None
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        # limit на одну строку больше порога: широкий фильтр не выгружает всю коллекцию в память
+        found = vectorstore._collection.get(
+            where=where, limit=self.max_rows_per_filter + 1, include=["embeddings", "documents", "metadatas"]
+        )
+        if len(found["ids"]) > self.max_rows_per_filter:
+            with self._lock:
+                self._too_broad.add(key)
+            return None
+        candidates = _Candidates(found["embeddings"], found["documents"], found["metadatas"])
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = candidates
+                self._rows += len(candidates)
+            while self._rows > self.max_rows and len(self._entries) > 1:
+                self._rows -= len(self._entries.popitem(last=False)[1])
+        return candidates
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._too_broad.clear()
+            self._rows = 0
+
+
+CANDIDATES = CandidateCache()
+
+
+class FilteredMMRRetriever(BaseRetriever):
+    """
+    MMR поиск по Chroma с префильтром по метаданным (кампус, уровень образования, категория вопроса).
+    Кандидаты под фильтр берутся из CandidateCache, так что where выполняется один раз на комбинацию фильтров
+    (слишком широкие фильтры ищутся через where в Chroma).
+    Если с фильтром нашлось меньше min_candidates документов, повторяем поиск по всей коллекции.
+    """
+    vectorstore: Any
+    user_filters: List[str] = []
+    question_filters: List[str] = []
+    k: int = 4
+    fetch_k: int = 20
+    lambda_mult: float = .6
+    min_candidates: Optional[int] = None
+    max_tag_slots: int = MAX_TAG_SLOTS
+    # False - коллекция без ключей принадлежности, фильтр по позиционным слотам
+    membership_keys: bool = True
+    # кэшировать чанки под фильтр и искать по ним, а не по where на каждом запросе
+    cache_candidates: bool = True
+    # CandidateCache с нужным лимитом памяти, по умолчанию общий CANDIDATES
+    candidate_cache: Optional[Any] = None
+    # эмбеддинг запроса, если он уже посчитан (например, SemanticAnswerCache.embed_query при промахе кэша)
+    query_embedding: Optional[List[float]] = None
+    # PipelineTrace из tracing.py, если нужно замерить этапы embedding / retrieval
+    trace: Optional[Any] = None
+
+    def _stage(self, name: str):
+        return self.trace.stage(name) if self.trace is not None else nullcontext()
+
+    def _search(self, embedding: List[float], where: Optional[Dict[str, Any]]) -> List[Document]:
+        with self._stage("retrieval"):
+            return self.vectorstore.max_marginal_relevance_search_by_vector(
+                embedding,
+                k=self.k,
+                fetch_k=self.fetch_k,
+                lambda_mult=self.lambda_mult,
+                filter=where,
+            )
+
+    def _search_candidates(self, embedding: List[float], candidates: _Candidates) -> List[Document]:
+        """То же, что max_marginal_relevance_search_by_vector в Chroma, но по закэшированным кандидатам"""
+        fetch_k = min(self.fetch_k, len(candidates))
+        if fetch_k == 0 or self.k == 0:
+            return []
+        with self._stage("retrieval"):
+            query = np.asarray(embedding, dtype=np.float32)
+            scores = candidates.matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+            top = np.argpartition(-scores, fetch_k - 1)[:fetch_k]
+            top = top[np.argsort(-scores[top])]
+            selected = maximal_marginal_relevance(query, candidates.matrix[top], k=self.k, lambda_mult=self.lambda_mult)
+            # как в Chroma: документы в порядке близости к запросу, а не в порядке выбора MMR
+            return [
+                Document(page_content=candidates.documents[i], metadata=candidates.metadatas[i])
+                for i in top[sorted(selected)]
+            ]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        # эмбеддинг считаем один раз, он нужен и для фильтрованного поиска, и для fallback
+        embedding = self.query_embedding
+        if embedding is None:
+            with self._stage("embedding"):
+                embedding = self.vectorstore.embeddings.embed_query(query)
+        where = build_metadata_filter(
+            self.user_filters, self.question_filters, self.max_tag_slots, self.membership_keys
+        )
+        if where is None:
+            return self._search(embedding, None)
+
+        min_candidates = self.min_candidates if self.min_candidates is not None else self.k
+        if self.cache_candidates:
+            cache = self.candidate_cache if self.candidate_cache is not None else CANDIDATES
+            with self._stage("retrieval"):
+                candidates = cache.get(self.vectorstore, where)
+            if candidates is not None:
+                if len(candidates) < min_candidates:
+                    return self._search(embedding, None)
+                return self._search_candidates(embedding, candidates)
+
+        docs = self._search(embedding, where)
+        if len(docs) < min_candidates:
+            docs = self._search(embedding, None)
+        return docs
@@ -0,0 +1,121 @@
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import BaseCallbackHandler, Callbacks
+from langchain_core.documents import Document
+from langchain_core.documents.compressor import BaseDocumentCompressor
+
+# Этапы generate_answer в порядке выполнения, cache - поиск в SemanticAnswerCache
+STAGES = ["cache", "embedding", "retrieval", "compression", "generation"]
+
+
+class PipelineTrace:
+    """
+    Время и токены по этапам одного вызова generate_answer:
+    поиск в кэше ответов, эмбеддинг запроса, MMR retrieval, сжатие контекстов LLMChainExtractor и финальная генерация.
+    """
+    def __init__(self):
+        self.latency: Dict[str, float] = {}
+        self.tokens: Dict[str, int] = {}
+        self._active: List[str] = []
+
+    @property
+    def current_stage(self) -> Optional[str]:
+        return self._active[-1] if self._active else None
+
+    def add(self, stage: str, seconds: float = 0.0, tokens: int = 0) -> None:
+        self.latency[stage] = self.latency.get(stage, 0.0) + seconds
+        if tokens:
+            self.tokens[stage] = self.tokens.get(stage, 0) + tokens
+
+    @contextmanager
+    def stage(self, name: str):
+        """Замер времени этапа: with trace.stage("retrieval"): ..."""
+        self._active.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._active.pop()
+            self.add(name, time.perf_counter() - start)
+
+    def to_log(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Поля для записи в лог: stage_latency (сек) и stage_tokens по этапам.
+        Пишутся только выполненные этапы: при попадании в кэш это embedding и cache, и нули за пропущенные
+        эмбеддинг / retrieval / генерацию не занижают p50/p95 этапов на дашборде.
+        """
+        stages = [stage for stage in STAGES if stage in self.latency]
+        return {
+            "stage_latency": {stage: round(self.latency[stage], 6) for stage in stages},
+            "stage_tokens": {stage: self.tokens.get(stage, 0) for stage in stages},
+        }
+
+
+def trace_stage(trace: Optional[PipelineTrace], name: str):
+    """trace.stage(name), если трейс передан, иначе пустой контекст"""
+    return trace.stage(name) if trace is not None else nullcontext()
+
+
+def _usage_value(usage, name: str) -> int:
+    """Поле token_usage: у OpenAI это dict, у GigaChat - pydantic модель Usage"""
+    value = usage.get(name) if isinstance(usage, dict) else getattr(usage, name, None)
+    return int(value or 0)
+
+
+def _total_tokens(response) -> int:
+    """Токены из ответа LLM: token_usage в llm_output (GigaChat, OpenAI) или usage_metadata сообщения"""
+    usage = (response.llm_output or {}).get("token_usage")
+    if usage:
+        return _usage_value(usage, "total_tokens") or (
+            _usage_value(usage, "prompt_tokens") + _usage_value(usage, "completion_tokens")
+        )
+    total = 0
+    for generations in response.generations:
+        for generation in generations:
+            message = getattr(generation, "message", None)
+            if message is not None and getattr(message, "usage_metadata", None):
+                total += message.usage_metadata.get("total_tokens", 0)
+    return total
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Считает токены всех вызовов LLM и относит их к текущему этапу трейса.
+    Вызовы LLM вне открытого этапа - это финальная генерация ответа, для них замеряется и время.
+    """
+    def __init__(self, trace: PipelineTrace):
+        self.trace = trace
+        self._starts: Dict[Any, float] = {}
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs) -> None:
+        self._starts[run_id] = time.perf_counter()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs) -> None:
+        self._starts[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response, *, run_id, **kwargs) -> None:
+        start = self._starts.pop(run_id, None)
+        tokens = _total_tokens(response)
+        stage = self.trace.current_stage
+        if stage is None:
+            seconds = time.perf_counter() - start if start is not None else 0.0
+            self.trace.add("generation", seconds, tokens)
+        else:
+            self.trace.add(stage, 0.0, tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs) -> None:
+        self._starts.pop(run_id, None)
+
+
+class TracedCompressor(BaseDocumentCompressor):
+    """Обертка над компрессором (LLMChainExtractor), замеряющая этап compression"""
+    base_compressor: BaseDocumentCompressor
+    trace: Any
+
+    def compress_documents(
+        self, documents: List[Document], query: str, callbacks: Callbacks = None
+    ) -> List[Document]:
+        with self.trace.stage("compression"):
+            return list(self.base_compressor.compress_documents(documents, query, callbacks=callbacks))